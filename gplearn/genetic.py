@@ -10,11 +10,23 @@ computer programs.
 # License: BSD 3 clause
 
 import numpy as np
+import gc
+import hashlib
+import heapq
 import itertools
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import warnings
 
 from abc import ABCMeta, abstractmethod
 from copy import deepcopy
+from functools import partial
+from math import factorial
 from time import time
+from uuid import uuid4
 
 from scipy.stats import rankdata
 
@@ -23,33 +35,84 @@ from sklearn.externals import six
 from sklearn.externals.joblib import Parallel, delayed
 from sklearn.utils.random import sample_without_replacement
 
-from .skutils import _partition_estimators
+from .skutils import _get_n_jobs, _partition_estimators
+from .skutils.fixes import OrderedDict
 from .skutils.validation import check_random_state, NotFittedError
 from .skutils.validation import check_X_y, check_array
 
-__all__ = ['SymbolicRegressor', 'SymbolicTransformer']
+__all__ = ['SymbolicRegressor', 'SymbolicTransformer', 'register_function']
 
 MAX_INT = np.iinfo(np.int32).max
 
+# Candidate numbers of rows to execute programs on at a time, and the one
+# found to be the fastest in this process
+_BLOCK_SIZES = [2 ** i for i in range(12, 18)]
+_block_size = None
 
-def protected_devision(x1, x2):
+# The time taken to evaluate each function, measured on first use in each
+# process
+_function_timings = {}
+
+# The approximations found to be faster than the exact functions in this
+# process, keyed by the exact functions
+_approximations = None
+
+# The number of times a genetic operation is re-drawn when its offspring
+# exceeds max_depth or max_length, before falling back to the parent
+_MAX_ATTEMPTS = 10
+
+# The most work buffers that programs executed together may keep live at
+# once, batches of programs needing more are split
+_MAX_REGISTERS = 64
+
+# The key of the fit using this process's subtree cache, and the cache
+_subtree_cache = (None, None)
+_subtree_cache_lock = threading.Lock()
+
+
+def _unprotected(x1):
+    """Return a boolean mask of where x1 is too close to zero to be used."""
+    mask = np.asarray(np.less(x1, -0.001))
+    mask |= np.greater(x1, 0.001)
+    return np.logical_not(mask, out=mask)
+
+
+def _output(out, *args):
+    """Return `out`, or a new array the shape of the broadcast arguments."""
+    if out is None:
+        out = np.empty(np.broadcast(*args).shape)
+    return out
+
+
+def protected_devision(x1, x2, out=None):
     """Closure of division (x1/x2) for zero denominator."""
-    return np.where(np.abs(x2) > 0.001, np.divide(x1, x2), 1.)
+    mask = _unprotected(x2)
+    out = np.divide(x1, x2, out=_output(out, x1, x2))
+    np.copyto(out, 1., where=mask)
+    return out
 
 
-def protected_sqrt(x1):
+def protected_sqrt(x1, out=None):
     """Closure of square root for negative arguments."""
-    return np.sqrt(np.abs(x1))
+    out = np.abs(x1, out=_output(out, x1))
+    return np.sqrt(out, out=out)
 
 
-def protected_log(x1):
+def protected_log(x1, out=None):
     """Closure of log for zero arguments."""
-    return np.where(np.abs(x1) > 0.001, np.log(np.abs(x1)), 0.)
+    mask = _unprotected(x1)
+    out = np.abs(x1, out=_output(out, x1))
+    np.log(out, out=out)
+    np.copyto(out, 0., where=mask)
+    return out
 
 
-def protected_inverse(x1):
-    """Closure of log for zero arguments."""
-    return np.where(np.abs(x1) > 0.001, 1. / x1, 0.)
+def protected_inverse(x1, out=None):
+    """Closure of inverse for zero arguments."""
+    mask = _unprotected(x1)
+    out = np.divide(1., x1, out=_output(out, x1))
+    np.copyto(out, 0., where=mask)
+    return out
 
 
 # Format is '<name><arity>': function
@@ -68,16 +131,316 @@ FUNCTIONS = {'add2': np.add,
              'cos1': np.cos,
              'tan1': np.tan}
 
+# The number of arguments of each function
+_ARITIES = dict((name, int(name[-1])) for name in FUNCTIONS)
+
+
+class _Function(object):
+
+    """A user-defined function, as registered with `register_function`.
+
+    Calling the object evaluates the function, writing the result into the
+    `out` keyword argument if given, and replacing non-finite results with
+    zero unless the function is declared to be closed.
+
+    Parameters
+    ----------
+    function : callable
+        The vectorized function.
+
+    name : str
+        The name of the function in programs.
+
+    arity : int
+        The number of arguments of the function.
+
+    closure : bool
+        Whether the function returns finite values for all finite arguments.
+
+    cost : float or None
+        The cost of evaluating the function, relative to 'add2'.
+
+    inplace : callable or None
+        An implementation of the function writing its result into an `out`
+        keyword argument.
+    """
+
+    def __init__(self, function, name, arity, closure, cost, inplace):
+        self.function = function
+        self.name = name
+        self.arity = arity
+        self.closure = closure
+        self.cost = cost
+        self.inplace = inplace
+
+    def __call__(self, *args, **kwargs):
+        out = kwargs.get('out')
+        if out is None:
+            result = self.function(*args)
+        elif self.inplace is not None:
+            result = self.inplace(*args, out=out)
+        else:
+            out[...] = self.function(*args)
+            result = out
+        if self.closure:
+            return result
+        if out is None:
+            return np.where(np.isfinite(result), result, 0.)
+        np.copyto(out, 0., where=np.logical_not(np.isfinite(out)))
+        return out
+
+
+def register_function(function, name, arity, closure=True, cost=None,
+                      inplace=None):
+    """Make a user-defined function available to the estimators.
+
+    Registered functions may be included in an estimator's `function_set`.
+    They are pickled by reference along with the estimator's parameters, so
+    that they are also available in the processes of parallel fits, and so
+    must be importable, e.g. defined at the top level of a module.
+
+    Parameters
+    ----------
+    function : callable
+        A vectorized function taking `arity` NumPy arrays or scalars, and
+        returning an array of their broadcast shape.
+
+    name : str
+        The name of the function, used in the `function_set` and the string
+        representation of programs. Registering a name again replaces the
+        previous function, the built-in functions cannot be replaced. Fitted
+        estimators using a function that has since been replaced raise a
+        ValueError when predicting or transforming.
+
+    arity : int
+        The number of arguments of the function.
+
+    closure : bool, optional (default=True)
+        Whether the function returns finite values for all finite arguments,
+        as for protected division. If False, non-finite results are replaced
+        with zero.
+
+    cost : float, optional (default=None)
+        The cost of evaluating the function relative to 'add2', used when
+        `function_costs` is "auto" or does not include the function. If None,
+        the cost is measured when `function_costs` is "auto".
+
+    inplace : callable, optional (default=None)
+        An implementation of the function writing its result into an `out`
+        keyword argument and returning it, which saves allocating the result
+        of each evaluation. `out` may be one of the arguments, as for NumPy
+        ufuncs. If None, the result of `function` is copied into `out`.
+    """
+    if not isinstance(name, six.string_types):
+        raise ValueError('name must be a string, got %s.' % type(name))
+    if name in FUNCTIONS and not isinstance(FUNCTIONS[name], _Function):
+        raise ValueError('The built-in function %s cannot be replaced.'
+                         % name)
+    if not isinstance(arity, (int, np.integer)) or arity < 1:
+        raise ValueError('arity must be a positive integer, got %s.' % arity)
+    if cost is not None and not cost > 0:
+        raise ValueError('cost must be positive or None, got %s.' % cost)
+    for implementation in (function, inplace):
+        if implementation is None:
+            continue
+        if not callable(implementation):
+            raise ValueError('%s is not callable.' % implementation)
+        try:
+            pickle.dumps(implementation)
+        except Exception:
+            raise ValueError('%s cannot be pickled by reference, define it at '
+                             'the top level of a module.' % implementation)
+
+    # Check that the functions are vectorized
+    args = [np.ones(10)] * arity
+    with np.errstate(all='ignore'):
+        results = [function(*args)]
+        if inplace is not None:
+            results.append(inplace(*args, out=np.empty(10)))
+    for result in results:
+        if not hasattr(result, 'shape') or result.shape != (10,):
+            raise ValueError('The function %s must return an array of the '
+                             'shape of its arguments.' % name)
+
+    _install_functions({name: _Function(function, name, int(arity),
+                                        bool(closure), cost, inplace)})
+    _function_timings.pop(name, None)
+
+
+# Taylor series of sin(x) / x and 2 * atanh(x) / x in x ** 2, highest order
+# first
+_SIN_COEFFICIENTS = [(-1.) ** k / factorial(2 * k + 1)
+                     for k in range(5, -1, -1)]
+_ATANH_COEFFICIENTS = [2. / (2 * k + 1) for k in range(6, -1, -1)]
+
+
+def _horner(x1, coefficients, out):
+    """Evaluate a polynomial of x1 into `out`, which must not be x1."""
+    np.multiply(x1, coefficients[0], out=out)
+    for coefficient in coefficients[1:-1]:
+        out += coefficient
+        out *= x1
+    out += coefficients[-1]
+    return out
+
+
+def _approximate_sin(x1, out=None):
+    """Approximation of sine, to within about 1e-7 for |x1| < 1e6."""
+    turns = np.multiply(x1, 1. / np.pi)
+    np.rint(turns, out=turns)
+    reduced = np.multiply(turns, np.pi)
+    out = np.subtract(x1, reduced, out=_output(out, x1))
+    # Keep the result bounded where the reduction has lost all precision
+    np.clip(out, -np.pi / 2, np.pi / 2, out=out)
+    # sin(x + k * pi) = (-1) ** k * sin(x)
+    np.fmod(turns, 2., out=turns)
+    np.abs(turns, out=turns)
+    turns *= -2.
+    turns += 1.
+    out *= turns
+    np.multiply(out, out, out=reduced)
+    out *= _horner(reduced, _SIN_COEFFICIENTS, turns)
+    return out
+
+
+def _approximate_cos(x1, out=None):
+    """Approximation of cosine, to within about 1e-7 for |x1| < 1e6."""
+    out = np.add(x1, np.pi / 2, out=_output(out, x1))
+    return _approximate_sin(out, out=out)
+
+
+def _approximate_tan(x1, out=None):
+    """Approximation of tangent, to within about 1e-7 relative error."""
+    turns = np.multiply(x1, 1. / np.pi)
+    np.rint(turns, out=turns)
+    turns *= np.pi
+    out = np.subtract(x1, turns, out=_output(out, x1))
+    np.clip(out, -np.pi / 2, np.pi / 2, out=out)
+    # cos(x) = sin(pi / 2 - |x|) keeps the relative error small at the poles
+    cosine = np.abs(out)
+    np.subtract(np.pi / 2, cosine, out=cosine)
+    squared = np.multiply(cosine, cosine)
+    cosine *= _horner(squared, _SIN_COEFFICIENTS, turns)
+    # Stay finite at the poles, as the cosine of the nearest double to pi / 2
+    np.maximum(cosine, np.cos(np.pi / 2), out=cosine)
+    np.multiply(out, out, out=squared)
+    out *= _horner(squared, _SIN_COEFFICIENTS, turns)
+    out /= cosine
+    return out
+
+
+def _approximate_log(x1, out=None):
+    """Approximation of protected log, to within about 1e-8."""
+    mask = _unprotected(x1)
+    out = np.abs(x1, out=_output(out, x1))
+    mantissa, exponent = np.frexp(out)
+    # log(m) = 2 * atanh((m - 1) / (m + 1)) where |(m - 1) / (m + 1)| <= 1/3
+    squared = np.add(mantissa, 1.)
+    mantissa -= 1.
+    mantissa /= squared
+    np.multiply(mantissa, mantissa, out=squared)
+    _horner(squared, _ATANH_COEFFICIENTS, out)
+    out *= mantissa
+    out += np.multiply(exponent, np.log(2.))
+    np.copyto(out, 0., where=mask)
+    return out
+
+
+# Approximations of the transcendental functions, which may be used during
+# evolution, keyed by the exact functions
+_APPROXIMATIONS = {np.sin: _approximate_sin,
+                   np.cos: _approximate_cos,
+                   np.tan: _approximate_tan,
+                   protected_log: _approximate_log}
+
+
+def _display_name(name):
+    """Return the name of a function as shown in programs."""
+    if isinstance(FUNCTIONS[name], _Function):
+        return name
+    # Built-in functions are named with their arity as a suffix
+    return name[:-1]
+
+
+def _install_functions(functions, replace=True):
+    """Make registered functions, by name, available in this process.
+
+    Unless `replace`, a ValueError is raised rather than replacing another
+    function available under one of the names.
+    """
+    for name, function in functions.items():
+        current = FUNCTIONS.get(name, function)
+        if not replace and (not isinstance(current, _Function) or
+                            vars(current) != vars(function)):
+            raise ValueError('The function %s of the estimator differs from '
+                             'the one registered under that name, register '
+                             'the original function again to use the '
+                             'estimator.' % name)
+    for name, function in functions.items():
+        FUNCTIONS[name] = function
+        _ARITIES[name] = function.arity
+
+
+# Associative and commutative functions, chains of which are fused
+_CHAIN_FUNCTIONS = (np.add, np.multiply, np.maximum, np.minimum)
+
+
+def _accumulate(function, *args, **kwargs):
+    """Apply a binary function cumulatively to the arguments, in order."""
+    out = kwargs.get('out')
+    result = function(args[0], args[1], out=out)
+    for arg in args[2:]:
+        result = function(result, arg, out=out)
+    return result
+
+
+def _fuse_chains(code):
+    """Fuse consecutive accumulations into a buffer into one instruction.
+
+    An instruction applying one of `_CHAIN_FUNCTIONS` to the result of the
+    previous one, which applied the same function, and writing in its
+    place, continues an accumulation into that buffer. The two are fused so
+    the whole chain runs as a single instruction. The operations and their
+    order are unchanged, so are the results.
+
+    Parameters
+    ----------
+    code : list of tuples
+        Compiled instructions of the form
+        `(function, arguments, destination, buffered)`.
+
+    Returns
+    -------
+    code : list of tuples
+        The instructions, with chains fused.
+    """
+    fused = []
+    base = None
+    for function, arguments, destination, buffered in code:
+        if (buffered and function is base and function is not None and
+                arguments.count(destination) == 1 and
+                fused[-1][2] == destination):
+            other = arguments[1 - arguments.index(destination)]
+            previous = fused.pop()
+            fused.append((partial(_accumulate, function),
+                          previous[1] + (other,), destination, True))
+            continue
+        fused.append((function, arguments, destination, buffered))
+        base = None
+        if buffered and function in _CHAIN_FUNCTIONS:
+            base = function
+    return fused
+
 
 def weighted_pearson(x1, x2, w):
     """Calculate the weighted Pearson correlation coefficient."""
-    old_settings = np.seterr(divide='ignore', invalid='ignore')
-    x1_demean = x1 - np.average(x1, weights=w)
-    x2_demean = x2 - np.average(x2, weights=w)
-    corr = ((np.sum(w * x1_demean * x2_demean) / np.sum(w)) /
-            np.sqrt((np.sum(w * x1_demean ** 2) * np.sum(w * x2_demean ** 2)) /
-                    (np.sum(w) ** 2)))
-    np.seterr(**old_settings)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x1_demean = x1 - np.average(x1, weights=w)
+        x2_demean = x2 - np.average(x2, weights=w)
+        corr = ((np.sum(w * x1_demean * x2_demean) / np.sum(w)) /
+                np.sqrt((np.sum(w * x1_demean ** 2) *
+                         np.sum(w * x2_demean ** 2)) /
+                        (np.sum(w) ** 2)))
     if np.isfinite(corr):
         return np.abs(corr)
     return 0
@@ -90,44 +453,928 @@ def weighted_spearman(x1, x2, w):
     return weighted_pearson(x1_ranked, x2_ranked, w)
 
 
-def _parallel_evolve(n_programs, parents, X, y, sample_weight, seeds, params):
-    """Private function used to build a batch of programs within a job."""
-    n_samples, n_features = X.shape
+class _FitnessContext(object):
+
+    """The target statistics used to evaluate the raw fitness of programs.
+
+    The quantities of the metric that only depend on the target and the
+    sample weights, such as `log(y + 1)` for 'rmsle' or the weighted mean
+    and variance of `y` (or of its ranks) for the correlations, are computed
+    once for all of the programs evaluated on the same samples. Calling the
+    context evaluates the metric on a program's output in reusable work
+    buffers, performing the same operations as `np.average`,
+    `weighted_pearson` and `weighted_spearman`.
+
+    Parameters
+    ----------
+    y : array-like, shape = [n_samples]
+        Target values.
+
+    sample_weight : array-like, shape = [n_samples]
+        Weights applied to individual samples.
+
+    metric : str
+        The name of the raw fitness metric.
+    """
+
+    def __init__(self, y, sample_weight, metric):
+        if metric not in ('mean absolute error', 'mse', 'rmse', 'rmsle',
+                          'pearson', 'spearman'):
+            raise ValueError('Unsupported metric: %s' % metric)
+        self.metric = metric
+        self.sample_weight = sample_weight
+        self.total_weight = np.sum(sample_weight)
+        if metric == 'rmsle':
+            y = np.log(y + 1)
+        elif metric in ('pearson', 'spearman'):
+            if metric == 'spearman':
+                y = rankdata(y)
+            y = y - np.average(y, weights=sample_weight)
+            self.sum_squares = np.sum(sample_weight * y ** 2)
+        self.y = y
+        self._buffers = {}
+
+    def __call__(self, y_pred):
+        """Evaluate the raw fitness of a program's output."""
+        if self.metric == 'spearman':
+            y_pred = rankdata(y_pred)
+        # Work in floating point, even on integer data
+        dtype = np.result_type(y_pred.dtype, self.y.dtype,
+                               self.sample_weight.dtype, np.float16)
+        if dtype not in self._buffers:
+            self._buffers[dtype] = (np.empty(self.y.shape, dtype=dtype),
+                                    np.empty(self.y.shape, dtype=dtype))
+        work, temp = self._buffers[dtype]
+
+        if self.metric in ('pearson', 'spearman'):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = (np.multiply(y_pred, self.sample_weight,
+                                    out=work).sum() / self.total_weight)
+                np.subtract(y_pred, mean, out=work)
+                np.multiply(self.sample_weight, work, out=temp)
+                temp *= self.y
+                covariance = temp.sum() / self.total_weight
+                np.square(work, out=temp)
+                temp *= self.sample_weight
+                corr = covariance / np.sqrt((temp.sum() * self.sum_squares) /
+                                            (self.total_weight ** 2))
+            if np.isfinite(corr):
+                return np.abs(corr)
+            return 0
+
+        if self.metric == 'rmsle':
+            np.add(y_pred, 1, out=work)
+            np.log(work, out=work)
+            work -= self.y
+        else:
+            np.subtract(y_pred, self.y, out=work)
+        if self.metric == 'mean absolute error':
+            np.abs(work, out=work)
+        else:
+            np.square(work, out=work)
+        work *= self.sample_weight
+        raw_fitness = work.sum() / self.total_weight
+        if self.metric in ('rmse', 'rmsle'):
+            raw_fitness = np.sqrt(raw_fitness)
+        return raw_fitness
+
+
+def _simplify(program):
+    """Return a simplified copy of a flattened program.
+
+    Subtrees made only of constants are folded into a single constant, and
+    identities of the protected functions are removed: `neg(neg(x))`
+    becomes `x`, `abs(abs(x))` and `abs(neg(x))` become `abs(x)`, `sqrt`
+    and `log` drop an `abs` or `neg` argument, adding or subtracting zero
+    and multiplying or dividing by one are removed, and `sub(x, x)` and
+    `div(x, x)` become `0` and `1`. Nested `max` and `min` chains are
+    flattened, their repeated operands dropped, and rebuilt as a single
+    left-deep accumulation of their largest operand first.
+    The simplified program returns the same values as the original wherever
+    the latter has no infinite or NaN intermediate results.
+
+    Parameters
+    ----------
+    program : list
+        The flattened tree representation of the program.
+
+    Returns
+    -------
+    program : list
+        The flattened tree representation of the simplified program.
+    """
+    # Each operand is a subtree, as its flattened nodes and a key that is
+    # equal for identical subtrees
+    operands = []
+    chains = {}
+    for node in reversed(program):
+        if not isinstance(node, six.string_types):
+            operands.append(([node], repr(node)))
+            continue
+        arity = _ARITIES[node]
+        args = operands[:-arity - 1:-1]
+        del operands[-arity:]
+        nodes = [arg[0] for arg in args]
+        keys = [arg[1] for arg in args]
+        constant = [len(arg) == 1 and isinstance(arg[0], float)
+                    for arg in nodes]
+        if all(constant):
+            with np.errstate(divide='ignore', invalid='ignore',
+                             over='ignore'):
+                value = float(FUNCTIONS[node](*[np.float64(arg[0])
+                                                for arg in nodes]))
+            operands.append(([value], repr(value)))
+            continue
+        if node == 'neg1' and nodes[0][0] == 'neg1':
+            operands.append((nodes[0][1:], keys[0][1][0]))
+            continue
+        elif node in ('abs1', 'sqrt1', 'log1'):
+            # These functions ignore the sign of their argument
+            while nodes[0][0] in ('neg1', 'abs1'):
+                nodes[0], keys[0] = nodes[0][1:], keys[0][1][0]
+        elif node in ('max2', 'min2'):
+            # Gather the operands of the whole chain, without repeats, and
+            # accumulate them from the largest one, any order gives the same
+            # result
+            chain = []
+            for arg in args:
+                if arg[0][0] == node:
+                    chain.extend(chains[arg[1]])
+                else:
+                    chain.append(arg)
+            unique = OrderedDict((arg[1], arg) for arg in chain)
+            chain = sorted(unique.values(), key=lambda arg: -len(arg[0]))
+            operand = chain[0]
+            for arg in chain[1:]:
+                operand = ([node] + operand[0] + arg[0],
+                           (node, (operand[1], arg[1])))
+            if len(chain) > 1:
+                chains[operand[1]] = chain
+            operands.append(operand)
+            continue
+        elif node in ('sub2', 'div2') and keys[0] == keys[1]:
+            value = 0. if node == 'sub2' else 1.
+            operands.append(([value], repr(value)))
+            continue
+        elif node in ('add2', 'sub2') and keys[1] == repr(0.):
+            operands.append(args[0])
+            continue
+        elif node in ('mul2', 'div2') and keys[1] == repr(1.):
+            operands.append(args[0])
+            continue
+        elif node in ('add2', 'mul2') and keys[0] in (repr(0.), repr(1.)):
+            if keys[0] == repr(0. if node == 'add2' else 1.):
+                operands.append(args[1])
+                continue
+        operands.append(([node] + [n for arg in nodes for n in arg],
+                         (node, tuple(keys))))
+    return operands[0][0]
+
+
+def _get_block_size():
+    """Return the number of rows to execute programs on at a time.
+
+    The size is tuned on first use in each process, by timing a synthetic
+    program on blocks of each of the candidate sizes in `_BLOCK_SIZES`.
+    """
+    global _block_size
+    if _block_size is None:
+        random_state = check_random_state(0)
+        X = random_state.uniform(size=(4 * _BLOCK_SIZES[-1], 4))
+        X = np.asfortranarray(X)
+        function_set = ['add2', 'sub2', 'mul2', 'div2', 'sqrt1', 'log1']
+        program = ['div2', 'mul2', 'add2', 0, 1, 'sub2', 2, 0.5, 'sqrt1',
+                   'log1', 'add2', 'mul2', 3, 0, 'sub2', 1, 'div2', 2, 3]
+        gp = _Program(function_set=function_set,
+                      arities={1: function_set[4:], 2: function_set[:4]},
+                      init_depth=(2, 6),
+                      init_method='full',
+                      n_features=4,
+                      const_range=(-1., 1.),
+                      metric='mse',
+                      p_point_replace=0.05,
+                      parsimony_coefficient=0.001,
+                      random_state=random_state,
+                      program=program)
+        pool = _BufferPool()
+        timings = []
+        for block_size in _BLOCK_SIZES:
+            gp.execute(X[:block_size], pool, block_size)
+            start_time = time()
+            gp.execute(X, pool, block_size)
+            timings.append(time() - start_time)
+        _block_size = _BLOCK_SIZES[int(np.argmin(timings))]
+    return _block_size
+
+
+def _time_function(function, args, out):
+    """Return the fastest of a few timings of a function writing into out."""
+    best = np.inf
+    for _ in range(5):
+        start_time = time()
+        for _ in range(20):
+            function(*args, out=out)
+        best = min(best, time() - start_time)
+    return max(best, 1e-9)
+
+
+def _get_approximations():
+    """Return the approximations to use, keyed by the exact functions.
+
+    Each approximation is timed against its exact function on first use in
+    each process, and only those found to be faster are used, as the speed
+    of NumPy's transcendental functions varies between builds.
+    """
+    global _approximations
+    if _approximations is None:
+        random_state = check_random_state(0)
+        args = random_state.uniform(-10., 10., size=(1, _BLOCK_SIZES[0]))
+        out = np.empty(_BLOCK_SIZES[0])
+        approximations = {}
+        with np.errstate(all='ignore'):
+            for function, approximation in _APPROXIMATIONS.items():
+                if (_time_function(approximation, args, out) <
+                        _time_function(function, args, out)):
+                    approximations[function] = approximation
+        _approximations = approximations
+    return _approximations
+
+
+def _approximate(code, approximations=True):
+    """Substitute the faster approximations into compiled code.
+
+    `approximations` are keyed by the exact functions, if not a dict those
+    found to be faster in this process are used. Only the instructions
+    writing into work buffers are substituted, those on constants are
+    evaluated exactly.
+    """
+    if not isinstance(approximations, dict):
+        approximations = _get_approximations()
+    if not approximations:
+        return code
+    return [(approximations.get(function, function) if buffered else
+             function, arguments, destination, buffered)
+            for function, arguments, destination, buffered in code]
+
+
+def _get_function_costs():
+    """Return the cost of evaluating each function, relative to 'add2'.
+
+    The costs are measured on first use of each function in each process,
+    by timing it on a block of rows and taking the fastest of a few repeats
+    to limit the effect of noise. Registered functions declaring a cost are
+    not measured.
+    """
+    random_state = check_random_state(0)
+    args = random_state.uniform(-2., 2., size=(max(_ARITIES.values()),
+                                               _BLOCK_SIZES[0]))
+    out = np.empty(_BLOCK_SIZES[0])
+    with np.errstate(all='ignore'):
+        for name, function in FUNCTIONS.items():
+            if (name in _function_timings or
+                    getattr(function, 'cost', None) is not None):
+                continue
+            _function_timings[name] = _time_function(
+                function, args[:_ARITIES[name]], out)
+
+    costs = {}
+    for name, function in FUNCTIONS.items():
+        costs[name] = getattr(function, 'cost', None)
+        if costs[name] is None:
+            costs[name] = _function_timings[name] / _function_timings['add2']
+    return costs
+
+
+def _evaluation_dtype(X):
+    """Return the floating point type to execute programs on `X` in.
+
+    Programs are executed in single precision on float32 data, halving the
+    memory traffic of their intermediate results, and in double precision
+    otherwise.
+    """
+    if X.dtype == np.float32:
+        return np.float32
+    return np.float64
+
+
+class _BufferPool(object):
+
+    """A pool of reusable work buffers for executing programs.
+
+    Programs executed with a pool write their intermediate results into its
+    buffers rather than allocating new arrays for every function call. A pool
+    is owned by a single job and is reused for every program it evaluates.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, n_buffers, n_samples, dtype=np.float64):
+        """Return `n_buffers` work buffers of length `n_samples`.
+
+        Parameters
+        ----------
+        n_buffers : int
+            The number of buffers required.
+
+        n_samples : int
+            The length of each buffer.
+
+        dtype : numpy dtype, optional (default=np.float64)
+            The type of the buffers.
+
+        Returns
+        -------
+        buffers : list of arrays, shape = [n_samples]
+            The work buffers, their contents are undefined.
+        """
+        buffers = self._buffers.setdefault((n_samples, np.dtype(dtype)), [])
+        while len(buffers) < n_buffers:
+            buffers.append(np.empty(n_samples, dtype=dtype))
+        return buffers[:n_buffers]
+
+
+class _SubtreeCache(object):
+
+    """A memory-bounded store of the evaluated outputs of subtrees.
+
+    Outputs are keyed by a digest of the subtree's structure, so that the
+    subtrees offspring inherit from their parents, or share with other
+    programs, need not be evaluated again. The least recently used outputs
+    are evicted once the cache outgrows its budget. The cache may be shared
+    by threads, the hits and lookups are counted for each thread.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The memory budget of the cache.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._outputs = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = threading.local()
+
+    @property
+    def n_hits(self):
+        """The number of lookups by this thread that found an output."""
+        return getattr(self._counts, 'n_hits', 0)
+
+    @property
+    def n_lookups(self):
+        """The number of lookups by this thread."""
+        return getattr(self._counts, 'n_lookups', 0)
+
+    def get(self, key):
+        """Return the output of the subtree `key`, or None if not cached."""
+        with self._lock:
+            output = self._outputs.pop(key, None)
+            if output is not None:
+                self._outputs[key] = output
+        self._counts.n_lookups = self.n_lookups + 1
+        if output is not None:
+            self._counts.n_hits = self.n_hits + 1
+        return output
+
+    def put(self, key, output):
+        """Keep the output of the subtree `key`, evicting older ones."""
+        if output.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._outputs:
+                return
+            self._outputs[key] = output
+            self.n_bytes += output.nbytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self._outputs.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+
+def _get_subtree_cache(key, max_bytes):
+    """Return this process's subtree cache for the fit identified by `key`.
+
+    A process keeps the cache of a single fit, which lives on across the
+    generations of that fit and is replaced when another fit uses it.
+    """
+    global _subtree_cache
+    with _subtree_cache_lock:
+        if _subtree_cache[0] != key:
+            _subtree_cache = (key, _SubtreeCache(max_bytes))
+        return _subtree_cache[1]
+
+
+def _release_subtree_cache(key):
+    """Free this process's subtree cache if it belongs to the fit `key`."""
+    global _subtree_cache
+    with _subtree_cache_lock:
+        if _subtree_cache[0] == key:
+            _subtree_cache = (None, None)
+
+
+def _compile_population(programs):
+    """Compile a batch of programs into a single instruction stream.
+
+    The simplified programs are merged into a directed acyclic graph in
+    which every distinct subtree is a single node, so subtrees shared
+    between programs, or repeated within one, are evaluated only once. Nodes
+    are evaluated program by program, the result of each program is reported
+    as soon as it is ready and work buffers are released once their last
+    use is done.
+
+    Parameters
+    ----------
+    programs : list of _Program
+        The programs to compile.
+
+    Returns
+    -------
+    code : list of tuples
+        The instructions in execution order, either of the form
+        `(function, arguments, destination, buffered)` as compiled by
+        `_Program._compile`, or `(None, program, result, last)` reporting
+        that the slot `result` holds the result of the program at index
+        `program`, where `last` indicates whether the slot is a register
+        that is reused after.
+
+    features : list of ints
+        The features used by the programs, loaded into the first slots.
+
+    constants : list of NumPy scalars
+        The distinct constants of the programs, loaded after the features.
+
+    n_temporaries : int
+        The number of slots holding the scalar results of constant
+        subtrees, following the constants.
+
+    n_registers : int
+        The number of work buffers required, in the final slots.
+    """
+    nodes = {}
+    names = []
+    children = []
+    scalar = []
+    n_uses = []
+    results = {}
+    for k, program in enumerate(programs):
+        operands = []
+        for node in reversed(program._get_simplified()):
+            if isinstance(node, six.string_types):
+                arity = _ARITIES[node]
+                args = tuple(operands[:-arity - 1:-1])
+                del operands[-arity:]
+                key = (node, args)
+            else:
+                args = ()
+                key = repr(node)
+            i = nodes.get(key)
+            if i is None:
+                i = nodes[key] = len(names)
+                names.append(node)
+                children.append(args)
+                scalar.append(all(scalar[arg] for arg in args) and
+                              not isinstance(node, int))
+                n_uses.append(0)
+                for arg in args:
+                    n_uses[arg] += 1
+            operands.append(i)
+        results.setdefault(operands[0], []).append(k)
+        n_uses[operands[0]] += 1
+
+    # Terminals are loaded first, then come the scalar temporaries and the
+    # registers
+    n_nodes = len(names)
+    slot = [None] * n_nodes
+    features = []
+    constants = []
+    for i in range(n_nodes):
+        if children[i]:
+            continue
+        if isinstance(names[i], int):
+            slot[i] = len(features)
+            features.append(names[i])
+        else:
+            slot[i] = len(constants)
+            constants.append(np.float64(names[i]))
+    n_temporaries = 0
+    for i in range(n_nodes):
+        if children[i]:
+            n_temporaries += scalar[i]
+        elif scalar[i]:
+            slot[i] += len(features)
+    next_temporary = len(features) + len(constants)
+    first_register = next_temporary + n_temporaries
+
+    # Nodes are numbered after their arguments, so evaluate them in order
+    code = []
+    free = []
+    n_registers = 0
+    for i in range(n_nodes):
+        if children[i]:
+            function = FUNCTIONS[names[i]]
+            arguments = tuple(slot[arg] for arg in children[i])
+            if scalar[i]:
+                slot[i] = next_temporary
+                next_temporary += 1
+                code.append((function, arguments, slot[i], False))
+            else:
+                # Release the registers used for the last time here so that
+                # the result may be written in place of an argument
+                for arg in children[i]:
+                    n_uses[arg] -= 1
+                    if n_uses[arg] == 0 and slot[arg] >= first_register:
+                        heapq.heappush(free, slot[arg] - first_register)
+                if free:
+                    slot[i] = first_register + heapq.heappop(free)
+                else:
+                    slot[i] = first_register + n_registers
+                    n_registers += 1
+                code.append((function, arguments, slot[i], True))
+        for k in results.get(i, ()):
+            n_uses[i] -= 1
+            last = n_uses[i] == 0 and slot[i] >= first_register
+            code.append((None, k, slot[i], last))
+            if last:
+                heapq.heappush(free, slot[i] - first_register)
+
+    return _fuse_chains(code), features, constants, n_temporaries, n_registers
+
+
+def _execute_population(programs, X, pool=None, approximate=False,
+                        block_size=None):
+    """Execute a batch of programs according to X, sharing common subtrees.
+
+    Like `_Program.execute`, the programs are evaluated on blocks of rows at
+    a time. As a result is only complete after the last block, each program
+    of a batch then needs an output buffer of its own, so programs are taken
+    `_MAX_REGISTERS` at a time. Batches needing more work buffers than that
+    are split, down to programs executed on their own.
+
+    Parameters
+    ----------
+    programs : list of _Program
+        The programs to execute.
+
+    X : {array-like}, shape = [n_samples, n_features]
+        Training vectors, where n_samples is the number of samples and
+        n_features is the number of features.
+
+    pool : _BufferPool, optional (default=None)
+        A pool of work buffers to evaluate the programs into. If None, new
+        buffers are allocated.
+
+    approximate : bool or dict, optional (default=False)
+        Whether to use the faster approximations of the transcendental
+        functions, or the approximations to use keyed by the exact functions.
+
+    block_size : int, optional (default=None)
+        The number of rows of `X` to evaluate the programs on at a time. If
+        None, it is tuned on first use.
+
+    Yields
+    ------
+    program : int
+        The index of a program in `programs`, each is yielded once.
+
+    y_hats : array-like, shape = [n_samples]
+        The result of executing the program on X. It is only valid until
+        the next program is yielded.
+    """
+    n_samples = X.shape[0]
+    if block_size is None:
+        block_size = n_samples
+        if n_samples > _BLOCK_SIZES[0]:
+            block_size = _get_block_size()
+    batch_size = max(len(programs), 1)
+    if n_samples > block_size:
+        batch_size = _MAX_REGISTERS
+    for start in range(0, len(programs), batch_size):
+        for k, output in _execute_batch(programs[start:start + batch_size],
+                                        X, pool, approximate, block_size):
+            yield start + k, output
+
+
+def _execute_batch(programs, X, pool, approximate, block_size):
+    """Private function used to execute programs together, on row blocks."""
+    n_samples = X.shape[0]
+    dtype = _evaluation_dtype(X)
+    (code, features, constants, n_temporaries,
+     n_registers) = _compile_population(programs)
+    if n_registers > _MAX_REGISTERS:
+        # Too many shared subtrees would be kept live, split the batch
+        if len(programs) == 1:
+            yield 0, programs[0].execute(X, pool, block_size,
+                                         approximate=approximate)
+            return
+        half = len(programs) // 2
+        for k, output in _execute_batch(programs[:half], X, pool,
+                                        approximate, block_size):
+            yield k, output
+        for k, output in _execute_batch(programs[half:], X, pool,
+                                        approximate, block_size):
+            yield half + k, output
+        return
+    if approximate:
+        code = _approximate(code, approximate)
+    constants = [dtype(constant) for constant in constants]
+
+    if n_samples > block_size:
+        # Each block's results are written straight into the outputs
+        if pool is None:
+            outputs = [np.empty(n_samples, dtype=dtype)
+                       for _ in range(len(programs))]
+            registers = [np.empty(block_size, dtype=dtype)
+                         for _ in range(n_registers)]
+        else:
+            outputs = pool.get(len(programs), n_samples, dtype)
+            registers = pool.get(n_registers, block_size, dtype)
+        # Stop warnings being raised for protected division, etc
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for start in range(0, n_samples, block_size):
+                stop = min(start + block_size, n_samples)
+                slots = ([X[start:stop, feature] for feature in features] +
+                         constants + [None] * n_temporaries +
+                         [register[:stop - start] for register in registers])
+                for function, arguments, destination, buffered in code:
+                    if function is None:
+                        outputs[arguments][start:stop] = slots[destination]
+                        continue
+                    terminals = [slots[arg] for arg in arguments]
+                    if buffered:
+                        function(*terminals, out=slots[destination])
+                    else:
+                        slots[destination] = function(*terminals)
+            # Protect for rmsle, as execute does for all but single nodes
+            for program, output in zip(programs, outputs):
+                if program.metric == 'rmsle' and len(program.program) > 1:
+                    output[output <= 1e-16] = 0
+        for k, output in enumerate(outputs):
+            yield k, output
+        return
+
+    if pool is None:
+        registers = [np.empty(n_samples, dtype=dtype)
+                     for _ in range(n_registers)]
+    else:
+        registers = pool.get(n_registers, n_samples, dtype)
+    slots = ([X[:, feature] for feature in features] + constants +
+             [None] * n_temporaries + registers)
+
+    index = 0
+    while index < len(code):
+        # Stop warnings being raised for protected division, etc, but not
+        # while the caller uses the outputs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            function, arguments, destination, buffered = code[index]
+            while function is not None:
+                terminals = [slots[arg] for arg in arguments]
+                if buffered:
+                    function(*terminals, out=slots[destination])
+                else:
+                    slots[destination] = function(*terminals)
+                index += 1
+                function, arguments, destination, buffered = code[index]
+            program = programs[arguments]
+            output = slots[destination]
+            last = buffered
+            if np.ndim(output) == 0:
+                # Program only depends on constants
+                output = np.repeat(output, n_samples)
+                last = True
+            # Protect for rmsle, as execute does for all but single nodes
+            if program.metric == 'rmsle' and len(program.program) > 1:
+                if not last:
+                    output = output.copy()
+                output[output <= 1e-16] = 0
+        index += 1
+        yield arguments, output
+
+
+def _all_rows(n_samples):
+    """Return read-only indices of all of the rows, shared by programs."""
+    indices = np.arange(n_samples)
+    indices.flags.writeable = False
+    return indices
+
+
+class _Population(object):
+
+    """A compact encoding of programs, for exchange with worker processes.
+
+    Pickling `_Program` objects sends every attribute of every program to
+    each job. Instead, the nodes of all of the programs are flattened into
+    a few NumPy arrays, which joblib memory-maps into the worker processes
+    rather than pickling, and the programs are rebuilt from them only where
+    they are needed.
+
+    Parameters
+    ----------
+    programs : list of _Program
+        The programs to encode.
+
+    function_set : list
+        The functions the programs are made of.
+
+    fitness : array-like, shape = [n_programs], optional (default=None)
+        The fitness of each program.
+
+    genomes : list of dict, optional (default=None)
+        The genetic operations yielding each program.
+
+    in_bag : list of arrays, optional (default=None)
+        The rows of `X` that each program was evaluated on. If None, all of
+        them.
+
+    n_samples : int, optional (default=None)
+        The number of rows of `X`, required with `in_bag`.
+    """
+
+    def __init__(self, programs, function_set, fitness=None, genomes=None,
+                 in_bag=None, n_samples=None):
+        # Features are encoded as themselves, constants as -1 and functions
+        # as -2 and below
+        codes = dict((function, -2 - i)
+                     for i, function in enumerate(function_set))
+        nodes = [node for program in programs for node in program.program]
+        self.codes = np.array([codes[node] if isinstance(node,
+                                                         six.string_types)
+                               else node if isinstance(node, int) else -1
+                               for node in nodes], dtype=np.int32)
+        self.values = np.array([node if isinstance(node, float) else 0.
+                                for node in nodes])
+        self.offsets = np.cumsum([0] + [len(program.program)
+                                        for program in programs])
+        self.function_set = function_set
+        self.fitness = None
+        if fitness is not None:
+            self.fitness = np.asarray(fitness, dtype=np.float64)
+        self.genomes = genomes
+        self._all_rows = None
+        self.in_bag = None
+        if in_bag is not None:
+            # One bit per row
+            self.in_bag = np.zeros((len(programs), n_samples), dtype=bool)
+            for i, indices in enumerate(in_bag):
+                self.in_bag[i, indices] = True
+            self.in_bag = np.packbits(self.in_bag, axis=1)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_program(self, i):
+        """Return the flattened tree representation of the i-th program."""
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        program = []
+        for code, value in zip(self.codes[start:stop].tolist(),
+                               self.values[start:stop].tolist()):
+            if code >= 0:
+                program.append(code)
+            elif code == -1:
+                program.append(value)
+            else:
+                program.append(self.function_set[-2 - code])
+        return program
+
+    def get_indices(self, i, n_samples):
+        """Return the rows of `X` that the i-th program was evaluated on."""
+        if self.in_bag is None:
+            if (self._all_rows is None or
+                    self._all_rows.shape[0] != n_samples):
+                self._all_rows = _all_rows(n_samples)
+            return self._all_rows
+        return np.where(np.unpackbits(self.in_bag[i])[:n_samples])[0]
+
+
+class _SharedArrays(object):
+
+    """Shares arrays with worker processes through memory-mapped files.
+
+    On entering the context each array is written once to a temporary file,
+    and `arrays` is replaced with read-only memory maps of them. joblib sends
+    memory maps to worker processes by reference, so that the workers attach
+    to the same pages rather than being sent a copy of the data with every
+    call. The files are deleted on leaving the context, even on errors, so
+    the context should be left after the workers are shut down. Files that
+    are still mapped elsewhere may not be deletable on some platforms, in
+    which case a warning names the folder left behind.
+
+    Parameters
+    ----------
+    arrays : list of arrays or None
+        The arrays to share, None entries are kept as they are.
+
+    share : bool, optional (default=True)
+        Whether to share the arrays. If False, they are used as they are.
+    """
+
+    def __init__(self, arrays, share=True):
+        self.arrays = arrays
+        self.share = share
+        self._originals = None
+        self._temp_folder = None
+
+    def __enter__(self):
+        if not self.share:
+            return self
+        self._temp_folder = tempfile.mkdtemp(prefix='gplearn_')
+        shared = []
+        try:
+            for i, array in enumerate(self.arrays):
+                if array is not None:
+                    filename = os.path.join(self._temp_folder, '%d.npy' % i)
+                    np.save(filename, array)
+                    array = np.load(filename, mmap_mode='r')
+                shared.append(array)
+        except Exception:
+            self.__exit__()
+            raise
+        self._originals, self.arrays = self.arrays, shared
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._originals is not None:
+            # Release the memory maps before deleting their files
+            self.arrays, self._originals = self._originals, None
+        if self._temp_folder is not None:
+            temp_folder, self._temp_folder = self._temp_folder, None
+            try:
+                shutil.rmtree(temp_folder)
+            except OSError:
+                # Collect any memory maps left unreferenced, and try again
+                gc.collect()
+                try:
+                    shutil.rmtree(temp_folder)
+                except OSError as e:
+                    warnings.warn('Failed to delete the temporary folder %s: '
+                                  '%s' % (temp_folder, e))
+
+
+def _make_program(params, n_features, random_state, program=None):
+    """Private function used to build a program from the fit's parameters."""
+    return _Program(function_set=params['function_set'],
+                    arities=params['arities'],
+                    init_depth=params['init_depth'],
+                    init_method=params['init_method'],
+                    n_features=n_features,
+                    metric=params['metric'],
+                    const_range=params['const_range'],
+                    p_point_replace=params['p_point_replace'],
+                    parsimony_coefficient=params['parsimony_coefficient'],
+                    random_state=random_state,
+                    program=program,
+                    max_length=params['max_length'],
+                    function_costs=params['function_costs'])
+
+
+def _breed_programs(parents, n_samples, n_features, seeds, params):
+    """Private function used to breed the programs of a generation.
+
+    Returns the programs, with the rows of `X` that each one is to be
+    evaluated on, and the parents that each one was bred from.
+    """
     # Unpack parameters
     tournament_size = params['tournament_size']
-    function_set = params['function_set']
-    arities = params['arities']
-    init_depth = params['init_depth']
-    init_method = params['init_method']
-    const_range = params['const_range']
     metric = params['metric']
-    parsimony_coefficient = params['parsimony_coefficient']
     method_probs = params['method_probs']
-    p_point_replace = params['p_point_replace']
     max_samples = params['max_samples']
+    max_depth = params['max_depth']
+    max_length = params['max_length']
 
     max_samples = int(max_samples * n_samples)
+    if parents is not None:
+        parent_fitness = np.array([parent.fitness_ for parent in parents])
 
     def _tournament():
         """Find the fittest individual from a sub-population."""
         contenders = random_state.randint(0, len(parents), tournament_size)
-        fitness = [parents[p].fitness_ for p in contenders]
+        fitness = parent_fitness[contenders]
         if metric in ('pearson', 'spearman'):
             parent_index = contenders[np.argmax(fitness)]
         else:
             parent_index = contenders[np.argmin(fitness)]
         return parents[parent_index], parent_index
 
+    def _fits(program):
+        """Check that an offspring is within the size limits."""
+        return ((max_length is None or len(program) <= max_length) and
+                (max_depth is None or parent._depth(program) <= max_depth))
+
+    # Programs evaluated on all of the samples share their indices
+    all_rows = _all_rows(n_samples)
+
     # Build programs
     programs = []
+    lineage = []
 
-    for i in range(n_programs):
+    for seed in seeds:
 
-        random_state = check_random_state(seeds[i])
+        random_state = check_random_state(seed)
 
         if parents is None:
             program = None
             genome = None
+            sources = ()
         else:
             method = random_state.uniform()
             parent, parent_index = _tournament()
@@ -135,74 +1382,349 @@ def _parallel_evolve(n_programs, parents, X, y, sample_weight, seeds, params):
             if method < method_probs[0]:
                 # crossover
                 donor, donor_index = _tournament()
-                program, removed, remains = parent.crossover(donor.program,
-                                                             random_state)
+                for _ in range(_MAX_ATTEMPTS):
+                    program, removed, remains = parent.crossover(
+                        donor.program, random_state)
+                    if _fits(program):
+                        break
                 genome = {'method': 'Crossover',
                           'parent_idx': parent_index,
                           'parent_nodes': removed,
                           'donor_idx': donor_index,
                           'donor_nodes': remains}
+                sources = (parent, donor)
             elif method < method_probs[1]:
                 # subtree_mutation
-                program, removed, _ = parent.subtree_mutation(random_state)
+                for _ in range(_MAX_ATTEMPTS):
+                    program, removed, _ = parent.subtree_mutation(
+                        random_state)
+                    if _fits(program):
+                        break
                 genome = {'method': 'Subtree Mutation',
                           'parent_idx': parent_index,
                           'parent_nodes': removed}
+                sources = (parent,)
             elif method < method_probs[2]:
                 # hoist_mutation
                 program, removed = parent.hoist_mutation(random_state)
                 genome = {'method': 'Hoist Mutation',
                           'parent_idx': parent_index,
                           'parent_nodes': removed}
+                sources = (parent,)
             elif method < method_probs[3]:
                 # point_mutation
                 program, mutated = parent.point_mutation(random_state)
                 genome = {'method': 'Point Mutation',
                           'parent_idx': parent_index,
                           'parent_nodes': mutated}
+                sources = (parent,)
             else:
                 # reproduction
                 program = parent.reproduce()
                 genome = {'method': 'Reproduction',
                           'parent_idx': parent_index,
                           'parent_nodes': []}
+                sources = (parent,)
+
+            if not _fits(program):
+                # Still too large after re-drawing, fall back to the parent
+                program = parent.reproduce()
+                genome = {'method': 'Reproduction',
+                          'parent_idx': parent_index,
+                          'parent_nodes': []}
+                sources = (parent,)
 
-        program = _Program(function_set=function_set,
-                           arities=arities,
-                           init_depth=init_depth,
-                           init_method=init_method,
-                           n_features=n_features,
-                           metric=metric,
-                           const_range=const_range,
-                           p_point_replace=p_point_replace,
-                           parsimony_coefficient=parsimony_coefficient,
-                           random_state=random_state,
-                           program=program)
+        program = _make_program(params, n_features, random_state, program)
 
         program.parents = genome
 
-        # Draw samples, using sample weights, and then fit
-        if sample_weight is None:
-            curr_sample_weight = np.ones((n_samples,))
-        else:
-            curr_sample_weight = sample_weight.copy()
-
+        # Draw samples, and then fit on the in-bag samples only
         not_indices = sample_without_replacement(
             n_samples,
             n_samples - max_samples,
             random_state=random_state)
-        sample_counts = np.bincount(not_indices, minlength=n_samples)
-        indices = np.where(sample_counts == 0)[0]
-        curr_sample_weight[not_indices] = 0
+        if max_samples < n_samples:
+            sample_counts = np.bincount(not_indices, minlength=n_samples)
+            program.indices_ = np.where(sample_counts == 0)[0]
+        else:
+            program.indices_ = all_rows
 
-        program.raw_fitness_ = program.raw_fitness(X, y, curr_sample_weight)
-        program.indices_ = indices
+        programs.append(program)
+        lineage.append(sources)
 
+    return programs, lineage
+
+
+def _balance_costs(costs, n_jobs):
+    """Private function used to share out tasks evenly between jobs.
+
+    Tasks are assigned from the most to the least costly, each one to the
+    job with the least total cost so far (longest processing time first).
+
+    Parameters
+    ----------
+    costs : array-like, shape = [n_tasks]
+        The estimated cost of each task.
+
+    n_jobs : int
+        The number of jobs.
+
+    Returns
+    -------
+    jobs : list of lists
+        The indices of the tasks of each job, in increasing order.
+    """
+    jobs = [[] for _ in range(n_jobs)]
+    loads = [(0, job) for job in range(n_jobs)]
+    # Ties are broken by position, so that the assignment is deterministic
+    for task in sorted(range(len(costs)), key=lambda task: -costs[task]):
+        load, job = heapq.heappop(loads)
+        jobs[job].append(task)
+        heapq.heappush(loads, (load + costs[task], job))
+    return [sorted(tasks) for tasks in jobs]
+
+
+def _evaluate_programs(programs, X, y, sample_weight, fitness_cache, params,
+                       lineage=None):
+    """Private function used to compute the raw fitness of programs.
+
+    Sets the `raw_fitness_` of each program, evaluated on the rows of `X`
+    in its `indices_`. If `lineage` is given, the outputs of the subtrees
+    that the programs share with their parents are reused. Returns the
+    number of hits and lookups in the subtree cache.
+    """
+    n_samples = X.shape[0]
+    # Unpack parameters
+    metric = params['metric']
+    max_samples = params['max_samples']
+    subtree_cache_size = params['subtree_cache_size']
+    parent_cache_size = params['parent_cache_size']
+    approximate = params['approximate']
+
+    max_samples = int(max_samples * n_samples)
+    if sample_weight is None:
+        sample_weight = np.ones((n_samples,), dtype=y.dtype)
+    # Shared by the programs evaluated on all of the samples
+    context = _FitnessContext(y, sample_weight, metric)
+
+    batch = []
+    pool = _BufferPool()
+    cache = None
+    if subtree_cache_size is not None and max_samples == n_samples:
+        cache = _get_subtree_cache(params['cache_key'],
+                                   int(subtree_cache_size * 2 ** 20))
+        n_hits, n_lookups = cache.n_hits, cache.n_lookups
+    budget = None
+    if (parent_cache_size is not None and max_samples == n_samples and
+            lineage is not None):
+        # Memory left to keep the outputs of subtrees for the next generation
+        budget = int(parent_cache_size * 2 ** 20)
+
+    for i, program in enumerate(programs):
+
+        in_bag = None
+        if max_samples < n_samples:
+            in_bag = program.indices_
+
+        if fitness_cache is None:
+            raw_fitness = program.raw_fitness(
+                X, y, sample_weight, pool, in_bag, approximate=approximate,
+                context=context if in_bag is None else None)
+        elif cache is None and budget is None:
+            # Evaluated together with the rest of the programs below
+            raw_fitness = None
+            batch.append(program)
+        else:
+            fingerprint = program._get_fingerprint()
+            raw_fitness = fitness_cache.get(fingerprint)
+            if raw_fitness is None:
+                # Keep the outputs of the subtrees if they surely fit
+                keep = (budget is not None and
+                        budget >= program.length_ * X[:, 0].nbytes)
+                raw_fitness = program.raw_fitness(
+                    X, y, sample_weight, pool, cache=cache,
+                    parents=() if lineage is None else lineage[i],
+                    keep=keep, approximate=approximate, context=context)
+                fitness_cache[fingerprint] = raw_fitness
+                if program._outputs is not None:
+                    budget -= sum(output.nbytes for output in
+                                  program._outputs.values())
+        program.raw_fitness_ = raw_fitness
+
+    if batch:
+        # Programs share many subtrees, evaluate each distinct one only once
+        unique = OrderedDict()
+        for program in batch:
+            fingerprint = program._get_fingerprint()
+            if fingerprint not in fitness_cache:
+                unique.setdefault(fingerprint, program)
+        fingerprints = list(unique.keys())
+        unique = list(unique.values())
+        for k, y_pred in _execute_population(unique, X, pool, approximate):
+            fitness_cache[fingerprints[k]] = unique[k].raw_fitness(
+                X, y, sample_weight, y_pred=y_pred, context=context)
+        for program in batch:
+            program.raw_fitness_ = fitness_cache[program._get_fingerprint()]
+
+    cache_stats = (0, 0)
+    if cache is not None:
+        cache_stats = (cache.n_hits - n_hits, cache.n_lookups - n_lookups)
+    return cache_stats
+
+
+def _parallel_evaluate(population, X, y, sample_weight, fitness_cache,
+                       params):
+    """Private function used to evaluate a batch of programs within a job."""
+    n_samples, n_features = X.shape
+    # Registered functions are not otherwise available in worker processes
+    _install_functions(params['functions'])
+
+    programs = []
+    for i in range(len(population)):
+        program = _make_program(params, n_features, None,
+                                population.get_program(i))
+        program.indices_ = population.get_indices(i, n_samples)
         programs.append(program)
+    cache_stats = _evaluate_programs(programs, X, y, sample_weight,
+                                     fitness_cache, params)
+    if params['release_cache']:
+        _release_subtree_cache(params['cache_key'])
+
+    return [program.raw_fitness_ for program in programs], cache_stats
+
 
+def _penalize(programs, parsimony_coefficient):
+    """Private function used to set the penalized fitness of programs."""
+    if parsimony_coefficient == 'auto':
+        length = [program.length_ for program in programs]
+        fitness = [program.raw_fitness_ for program in programs]
+        parsimony_coefficient = (np.cov(length, fitness)[1, 0] /
+                                 np.var(length))
+    else:
+        parsimony_coefficient = None
+    for program in programs:
+        program.fitness_ = program.fitness(parsimony_coefficient)
+
+
+def _decode_population(population, params, n_features, n_samples):
+    """Private function used to rebuild the programs returned by a job."""
+    programs = []
+    for i in range(len(population)):
+        program = _make_program(params, n_features, None,
+                                population.get_program(i))
+        program.raw_fitness_ = population.fitness[i]
+        program.parents = population.genomes[i]
+        program.indices_ = population.get_indices(i, n_samples)
+        programs.append(program)
     return programs
 
 
+def _migrate(population, starts, metric, migration_size, topology,
+             random_state):
+    """Private function used to exchange the fittest programs of islands.
+
+    Each island receives the `migration_size` fittest programs of the
+    islands it is connected to by `topology`, which replace its least fit
+    programs.
+
+    Returns
+    -------
+    parents : list of arrays
+        The indices in `population` of the parents of each island.
+    """
+    n_islands = len(starts) - 1
+    fitness = np.array([program.fitness_ for program in population])
+    if metric in ('pearson', 'spearman'):
+        fitness = -fitness
+    # The programs of each island, from the fittest to the least fit
+    ranked = [starts[i] + np.argsort(fitness[starts[i]:starts[i + 1]],
+                                     kind='mergesort')
+              for i in range(n_islands)]
+    parents = []
+    for i in range(n_islands):
+        if topology == 'ring':
+            sources = [(i - 1) % n_islands]
+        elif topology == 'random':
+            source = random_state.randint(n_islands - 1)
+            sources = [source + (source >= i)]
+        else:
+            sources = [j for j in range(n_islands) if j != i]
+        immigrants = np.concatenate([ranked[j][:migration_size]
+                                     for j in sources])
+        indices = np.arange(starts[i], starts[i + 1])
+        indices[ranked[i][-len(immigrants):] - starts[i]] = immigrants
+        parents.append(indices)
+    return parents
+
+
+def _evolve_island(parents, parent_indices, offset, X, y, sample_weight,
+                   seeds, params):
+    """Private function used to evolve an island within a job.
+
+    The island is evolved for one generation per row of `seeds`, starting
+    from `parents`, the programs at `parent_indices` of the whole previous
+    generation. Its programs are at `offset` onwards in the whole of each
+    generation, which the genomes of the programs refer to.
+    """
+    n_samples, n_features = X.shape
+    # Registered functions are not otherwise available in worker processes
+    _install_functions(params['functions'])
+
+    if parents is not None:
+        programs = []
+        for i in range(len(parents)):
+            program = _make_program(params, n_features, None,
+                                    parents.get_program(i))
+            program.fitness_ = parents.fitness[i]
+            programs.append(program)
+        parents = programs
+    fitness_cache = None
+    if int(params['max_samples'] * n_samples) == n_samples:
+        fitness_cache = OrderedDict()
+
+    generations = []
+    cache_stats = []
+    for gen_seeds in seeds:
+        programs, lineage = _breed_programs(parents, n_samples, n_features,
+                                            gen_seeds, params)
+        cache_stats.append(_evaluate_programs(programs, X, y, sample_weight,
+                                              fitness_cache, params,
+                                              lineage))
+        if parents is not None:
+            for program in parents:
+                program._outputs = None
+        if fitness_cache is not None:
+            # Refresh the cache, evicting the least recently seen programs
+            for program in programs:
+                fingerprint = program._get_fingerprint()
+                fitness_cache.pop(fingerprint, None)
+                fitness_cache[fingerprint] = program.raw_fitness_
+            while len(fitness_cache) > 2 * len(programs):
+                fitness_cache.popitem(last=False)
+        _penalize(programs, params['parsimony_coefficient'])
+
+        for program in programs:
+            for key in ('parent_idx', 'donor_idx'):
+                if program.parents is not None and key in program.parents:
+                    program.parents[key] = int(
+                        parent_indices[program.parents[key]])
+        in_bag = None
+        if fitness_cache is None:
+            in_bag = [program.indices_ for program in programs]
+        generations.append(_Population(programs, params['function_set'],
+                                       [program.raw_fitness_
+                                        for program in programs],
+                                       [program.parents
+                                        for program in programs],
+                                       in_bag, n_samples))
+        parents = programs
+        parent_indices = offset + np.arange(len(programs))
+    if params['release_cache']:
+        _release_subtree_cache(params['cache_key'])
+
+    return generations, cache_stats
+
+
 class _Program(object):
 
     """A program-like representation of the evolved program.
@@ -268,6 +1790,15 @@ class _Program(object):
         The flattened tree representation of the program. If None, a new naive
         random tree will be grown. If provided, it will be validated.
 
+    max_length : int, optional (default=None)
+        The maximum number of nodes of the naive random trees grown by the
+        program. If None, their length is only bounded by `init_depth`.
+
+    function_costs : dict, optional (default=None)
+        The cost of each function in the parsimony penalty, of the form
+        `{function name: cost}`, where terminals and missing functions cost
+        1.0. If None, every node costs 1.0.
+
     Attributes
     ----------
     program : list
@@ -290,6 +1821,10 @@ class _Program(object):
 
     length_ : int
         The number of functions and terminals in the program.
+
+    cost_ : float
+        The cost-weighted length of the program, used by the parsimony
+        penalty.
     """
 
     def __init__(self,
@@ -303,7 +1838,9 @@ class _Program(object):
                  p_point_replace,
                  parsimony_coefficient,
                  random_state,
-                 program=None):
+                 program=None,
+                 max_length=None,
+                 function_costs=None):
 
         self.function_set = function_set
         self.arities = arities
@@ -314,6 +1851,8 @@ class _Program(object):
         self.metric = metric
         self.p_point_replace = p_point_replace
         self.parsimony_coefficient = parsimony_coefficient
+        self.max_length = max_length
+        self.function_costs = function_costs
         self.program = program
 
         if self.program is not None:
@@ -327,6 +1866,23 @@ class _Program(object):
         self.raw_fitness_ = None
         self.fitness_ = None
         self.parents = None
+        self._compiled = None
+        self._simplified = None
+        self._fingerprint = None
+        self._outputs = None
+
+    def __getstate__(self):
+        """Drop the compiled program and kept outputs when pickling.
+
+        The simplified and compiled programs are rebuilt lazily, the outputs
+        of the subtrees are only kept for offspring evaluated in the same
+        process.
+        """
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        state['_simplified'] = None
+        state['_outputs'] = None
+        return state
 
     def build_program(self, random_state):
         """Build a naive random program.
@@ -351,19 +1907,24 @@ class _Program(object):
         function = random_state.randint(len(self.function_set))
         function = self.function_set[function]
         program = [function]
-        terminal_stack = [int(function[-1])]
+        terminal_stack = [_ARITIES[function]]
 
         while len(terminal_stack) != 0:
             depth = len(terminal_stack)
             choice = self.n_features + len(self.function_set)
             choice = random_state.randint(choice)
+            # Only add a function if the program can still be completed
+            # within max_length, whichever function it is
+            room = (self.max_length is None or
+                    len(program) + sum(terminal_stack) + max(self.arities) <=
+                    self.max_length)
             # Determine if we are adding a function or terminal
-            if (depth < max_depth) and (method == 'full' or
-                                        choice <= len(self.function_set)):
+            if (depth < max_depth) and room and (
+                    method == 'full' or choice <= len(self.function_set)):
                 function = random_state.randint(len(self.function_set))
                 function = self.function_set[function]
                 program.append(function)
-                terminal_stack.append(int(function[-1]))
+                terminal_stack.append(_ARITIES[function])
             else:
                 # We need a terminal, add a variable or constant
                 terminal = random_state.randint(self.n_features + 1)
@@ -385,7 +1946,7 @@ class _Program(object):
         terminals = [0]
         for node in self.program:
             if isinstance(node, six.string_types):
-                terminals.append(int(node[-1]))
+                terminals.append(_ARITIES[node])
             else:
                 terminals[-1] -= 1
                 while terminals[-1] == 0:
@@ -399,8 +1960,8 @@ class _Program(object):
         output = ''
         for i, node in enumerate(self.program):
             if isinstance(node, six.string_types):
-                terminals.append(int(node[-1]))
-                output += node[:-1] + '('
+                terminals.append(_ARITIES[node])
+                output += _display_name(node) + '('
             else:
                 if isinstance(node, int):
                     output += 'X%s' % node
@@ -438,9 +1999,9 @@ class _Program(object):
             if isinstance(node, six.string_types):
                 if i not in fade_nodes:
                     fill = "#136ed4"
-                terminals.append([int(node[-1]), i])
+                terminals.append([_ARITIES[node], i])
                 output += ('%d [label="%s", fillcolor="%s"] ;\n'
-                           % (i, node[:-1], fill))
+                           % (i, _display_name(node), fill))
             else:
                 if i not in fade_nodes:
                     fill = "#60a6f6"
@@ -470,13 +2031,27 @@ class _Program(object):
         # We should never get here
         return None
 
-    def _depth(self):
-        """Calculates the maximum depth of the program tree."""
+    def _depth(self, program=None):
+        """Calculates the maximum depth of the program tree.
+
+        Parameters
+        ----------
+        program : list, optional (default=None)
+            The flattened tree representation of the program. If None, the
+            embedded tree in the object will be used.
+
+        Returns
+        -------
+        depth : int
+            The maximum depth of the program tree.
+        """
+        if program is None:
+            program = self.program
         terminals = [0]
         depth = 1
-        for node in self.program:
+        for node in program:
             if isinstance(node, six.string_types):
-                terminals.append(int(node[-1]))
+                terminals.append(_ARITIES[node])
                 depth = max(len(terminals), depth)
             else:
                 terminals[-1] -= 1
@@ -489,7 +2064,322 @@ class _Program(object):
         """Calculates the number of functions and terminals in the program."""
         return len(self.program)
 
-    def execute(self, X):
+    def _cost(self):
+        """Calculates the cost-weighted length of the program."""
+        if self.function_costs is None:
+            return float(len(self.program))
+        return sum(self.function_costs.get(node, 1.)
+                   if isinstance(node, six.string_types) else 1.
+                   for node in self.program)
+
+    def _compile(self, inputs=(), stores=()):
+        """Compile the program into a register-based instruction stream.
+
+        Every function node whose subtree depends on `X` writes its result
+        into a work buffer ("register") through the `out` argument of the
+        function. Registers are assigned with Sethi-Ullman ordering: the
+        arguments of each function are evaluated in decreasing order of the
+        number of registers they need, and a register is released as soon as
+        its value has been consumed, so the peak number of live buffers only
+        grows with the logarithm of the program's size for balanced trees.
+        Subtrees made only of constants are evaluated on NumPy scalars and
+        never use a register. Structurally identical subtrees are only
+        evaluated once, their register is released after their last use.
+        Chains of associative functions accumulating into a register are
+        fused into single instructions by `_fuse_chains`. The simplified
+        program is compiled, so node indices refer to it.
+
+        Parameters
+        ----------
+        inputs : list of ints, optional
+            Nodes whose values are supplied by the caller, in input slot
+            order. Their subtrees, and any identical ones, are not evaluated.
+
+        stores : list of ints, optional
+            Nodes whose values are to be kept, in store slot order. They, or
+            one identical subtree, are written to their store slot instead of
+            a register.
+
+        Returns
+        -------
+        code : list of tuples
+            The instructions in execution order, each of the form
+            `(function, arguments, destination, buffered)`, where
+            `arguments` and `destination` are indices into the slots built by
+            `execute` and `buffered` indicates whether the destination is a
+            buffer to be written to through `out`.
+
+        features : list of ints
+            The features used by the program, loaded into the first slots and
+            followed by the `inputs`.
+
+        constants : list of NumPy scalars
+            The constant table of the program, loaded after the inputs.
+            These are passed to the functions as-is and broadcast against the
+            sample arrays, so no column is ever materialized for a constant.
+
+        n_temporaries : int
+            The number of slots holding the scalar results of constant
+            subtrees, following the constants and followed by the `stores`.
+
+        n_registers : int
+            The number of work buffers required, in the final slots.
+
+        result : int
+            The slot holding the result of the program.
+        """
+        program = self._get_simplified()
+        n_nodes = len(program)
+        slot = [None] * n_nodes
+        children = [()] * n_nodes
+        scalar = [True] * n_nodes
+        need = [0] * n_nodes
+        features = []
+        feature_slots = {}
+        constants = []
+
+        # Number the distinct subtrees, identical ones share a number
+        subtree = [None] * n_nodes
+        numbers = {}
+        operands = []
+        for i in range(n_nodes - 1, -1, -1):
+            node = program[i]
+            if isinstance(node, six.string_types):
+                arity = _ARITIES[node]
+                children[i] = tuple(operands[:-arity - 1:-1])
+                del operands[-arity:]
+                key = (node, tuple(subtree[arg] for arg in children[i]))
+            else:
+                key = repr(node)
+            subtree[i] = numbers.setdefault(key, len(numbers))
+            operands.append(i)
+        input_slots = dict((subtree[node], k) for k, node in enumerate(inputs))
+        store_slots = dict((subtree[node], k) for k, node in enumerate(stores))
+
+        # Label each function node with the number of registers its subtree
+        # needs, bottom-up
+        for i in range(n_nodes - 1, -1, -1):
+            node = program[i]
+            if subtree[i] in input_slots:
+                children[i] = ()
+                scalar[i] = False
+                slot[i] = input_slots[subtree[i]]
+            elif children[i]:
+                args = children[i]
+                scalar[i] = all(scalar[arg] for arg in args)
+                if not scalar[i]:
+                    held = sorted((need[arg] for arg in args
+                                   if need[arg] > 0), reverse=True)
+                    need[i] = max([1] + [n + k for k, n in enumerate(held)])
+            elif isinstance(node, int):
+                scalar[i] = False
+                if node not in feature_slots:
+                    feature_slots[node] = len(features)
+                    features.append(node)
+                slot[i] = feature_slots[node]
+            else:
+                slot[i] = len(constants)
+                constants.append(np.float64(node))
+
+        # Count the uses of each distinct subtree that is evaluated
+        n_uses = {}
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            for arg in children[i]:
+                if subtree[arg] not in n_uses:
+                    n_uses[subtree[arg]] = 0
+                    stack.append(arg)
+                n_uses[subtree[arg]] += 1
+
+        # Inputs come after the features, then come the constants, the
+        # scalar temporaries, the stores and finally the registers
+        n_temporaries = 0
+        for i in range(n_nodes):
+            if subtree[i] in input_slots:
+                slot[i] += len(features)
+            elif children[i]:
+                n_temporaries += scalar[i]
+            elif scalar[i]:
+                slot[i] += len(features) + len(inputs)
+        next_temporary = len(features) + len(inputs) + len(constants)
+        first_store = next_temporary + n_temporaries
+        first_register = first_store + len(stores)
+
+        # Emit the instructions in Sethi-Ullman order
+        code = []
+        free = []
+        n_registers = 0
+        evaluated = {}
+        stack = [(0, False)]
+        while stack:
+            i, expanded = stack.pop()
+            if not children[i]:
+                continue
+            if not expanded:
+                if subtree[i] in evaluated:
+                    # An identical subtree was evaluated already
+                    slot[i] = evaluated[subtree[i]]
+                    continue
+                stack.append((i, True))
+                order = sorted(children[i], key=lambda arg: -need[arg])
+                stack.extend((arg, False) for arg in reversed(order))
+                continue
+            function = FUNCTIONS[program[i]]
+            arguments = tuple(slot[arg] for arg in children[i])
+            if scalar[i]:
+                slot[i] = next_temporary
+                next_temporary += 1
+                evaluated[subtree[i]] = slot[i]
+                code.append((function, arguments, slot[i], False))
+                continue
+            # Release the registers used for the last time by this function
+            # so that its result may be written in place of an argument
+            for arg in children[i]:
+                n_uses[subtree[arg]] -= 1
+                if n_uses[subtree[arg]] == 0 and slot[arg] >= first_register:
+                    heapq.heappush(free, slot[arg] - first_register)
+            if subtree[i] in store_slots:
+                slot[i] = first_store + store_slots[subtree[i]]
+            elif free:
+                slot[i] = first_register + heapq.heappop(free)
+            else:
+                slot[i] = first_register + n_registers
+                n_registers += 1
+            evaluated[subtree[i]] = slot[i]
+            code.append((function, arguments, slot[i], True))
+
+        return (_fuse_chains(code), features, constants, n_temporaries,
+                n_registers, slot[0])
+
+    def _get_simplified(self):
+        """Return the simplified program that is evaluated in its place.
+
+        The program itself is left untouched for the genetic operations.
+        """
+        if self._simplified is None:
+            self._simplified = _simplify(self.program)
+        return self._simplified
+
+    def _get_compiled(self):
+        """Return the compiled program, compiling it on first use."""
+        if self._compiled is None:
+            self._compiled = self._compile()
+        return self._compiled
+
+    def _get_fingerprint(self):
+        """Return a digest identifying the program's nodes and constants.
+
+        Identical programs have the same fingerprint in every process, so it
+        can be used to share their fitness between jobs and generations.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.md5(
+                repr(self.program).encode('utf-8')).digest()
+        return self._fingerprint
+
+    def _match_subtrees(self, cache=None, parents=(), keep=False):
+        """Find the subtrees whose outputs are known, and those to keep.
+
+        Subtrees are those of the simplified program. Only subtrees with at
+        least two functions that depend on `X` are considered, cheaper ones
+        are faster to evaluate than to look up. The whole program is never
+        cached, as its fitness is kept instead.
+
+        Parameters
+        ----------
+        cache : _SubtreeCache, optional (default=None)
+            The cache to look the subtrees up in.
+
+        parents : list of _Program, optional
+            Programs whose kept subtree outputs are looked up first.
+
+        keep : bool, optional (default=False)
+            Whether the outputs of all the subtrees are to be kept.
+
+        Returns
+        -------
+        inputs : list of tuples
+            The largest subtrees with known outputs, as `(node, output)`.
+
+        stores : list of tuples
+            The subtrees to evaluate and keep or add to the cache, as
+            `(node, key)`.
+
+        kept : dict
+            If `keep`, the known outputs of the `inputs` and of the subtrees
+            found below them in the `parents`, by key.
+        """
+        program = self._get_simplified()
+        n_nodes = len(program)
+        keys = [None] * n_nodes
+        children = [()] * n_nodes
+        n_functions = [0] * n_nodes
+        variable = [False] * n_nodes
+        operands = []
+        for i in range(n_nodes - 1, -1, -1):
+            node = program[i]
+            if isinstance(node, six.string_types):
+                arity = _ARITIES[node]
+                args = operands[:-arity - 1:-1]
+                del operands[-arity:]
+                children[i] = tuple(args)
+                keys[i] = hashlib.md5(('%s(%s)' % (
+                    node, ','.join(keys[arg] for arg in args))).encode(
+                        'utf-8')).hexdigest()
+                n_functions[i] = 1 + sum(n_functions[arg] for arg in args)
+                variable[i] = any(variable[arg] for arg in args)
+            else:
+                keys[i] = repr(node)
+                variable[i] = isinstance(node, int)
+            operands.append(i)
+
+        outputs = [parent._outputs for parent in parents
+                   if parent._outputs is not None]
+
+        def _lookup(i):
+            for parent_outputs in outputs:
+                output = parent_outputs.get(keys[i])
+                if output is not None:
+                    return output
+            return None
+
+        inputs = []
+        stores = []
+        kept = {}
+        seen = set()
+        stack = list(children[0])
+        while stack:
+            i = stack.pop()
+            if n_functions[i] < 2 or not variable[i] or keys[i] in seen:
+                # Identical subtrees are only evaluated once
+                continue
+            seen.add(keys[i])
+            output = _lookup(i)
+            if output is None and cache is not None:
+                output = cache.get(keys[i])
+            if output is None:
+                if keep or cache is not None:
+                    stores.append((i, keys[i]))
+                stack.extend(children[i])
+                continue
+            inputs.append((i, output))
+            if keep:
+                # The subtrees of an input are inherited as they are
+                kept[keys[i]] = output
+                inner = list(children[i])
+                while inner:
+                    j = inner.pop()
+                    if n_functions[j] < 2 or not variable[j]:
+                        continue
+                    output = _lookup(j)
+                    if output is not None:
+                        kept[keys[j]] = output
+                    inner.extend(children[j])
+        return inputs, stores, kept
+
+    def execute(self, X, pool=None, block_size=None, indices=None,
+                cache=None, parents=(), keep=False, approximate=False):
         """Execute the program according to X.
 
         Parameters
@@ -498,53 +2388,145 @@ class _Program(object):
             Training vectors, where n_samples is the number of samples and
             n_features is the number of features.
 
+        pool : _BufferPool, optional (default=None)
+            A pool of work buffers to evaluate the program into. If None, new
+            buffers are allocated. When a pool is used the result may be one
+            of its buffers, and is only valid until the pool is used again.
+
+        block_size : int, optional (default=None)
+            The number of rows of `X` to evaluate the whole program on at a
+            time, so that the intermediate results of large datasets stay in
+            the CPU caches. If None, it is tuned on first use.
+
+        indices : array-like, shape = [n_subsamples], optional (default=None)
+            The rows of `X` to execute the program on. If None, all rows are
+            used. Only the features used by the program are gathered.
+
+        cache : _SubtreeCache, optional (default=None)
+            A cache of the outputs of subtrees evaluated on all rows of `X`.
+            Cached subtrees are not evaluated again, and the outputs of the
+            others are added to the cache. Not used with `indices`.
+
+        parents : list of _Program, optional
+            Programs that kept the outputs of their subtrees on all rows of
+            `X`. The subtrees shared with them are not evaluated again, so
+            offspring only evaluate the nodes changed by their genetic
+            operation and the path from those to the root. Not used with
+            `indices`.
+
+        keep : bool, optional (default=False)
+            Whether to keep the outputs of the program's subtrees for its own
+            offspring. Not used with `indices`.
+
+        approximate : bool or dict, optional (default=False)
+            Whether to use the faster approximations of the transcendental
+            functions, which are accurate to about 1e-7, or the
+            approximations to use keyed by the exact functions.
+
         Returns
         -------
-        y_hats : array-like, shape = [n_samples]
+        y_hats : array-like, shape = [n_samples] or [n_subsamples]
             The result of executing the program on X.
         """
-        # Stop warnings being raised for protected division, etc
-        old_settings = np.seterr(divide='ignore', invalid='ignore')
+        if indices is None:
+            n_samples = X.shape[0]
+        else:
+            n_samples = indices.shape[0]
+
+        dtype = _evaluation_dtype(X)
 
         # Check for single-node programs
         node = self.program[0]
         if isinstance(node, float):
-            return np.repeat(node, X.shape[0])
+            return np.repeat(dtype(node), n_samples)
         if isinstance(node, int):
-            return X[:, node]
-
-        apply_stack = []
-
-        for node in self.program:
-
-            if isinstance(node, six.string_types):
-                apply_stack.append([node])
+            if indices is None:
+                return X[:, node]
+            return X[indices, node]
+
+        inputs = stores = ()
+        if indices is None and (cache is not None or parents or keep):
+            inputs, stores, kept = self._match_subtrees(cache, parents, keep)
+        if inputs or stores:
+            (code, features, constants, n_temporaries, n_registers,
+             result) = self._compile([node for node, _ in inputs],
+                                     [node for node, _ in stores])
+        else:
+            (code, features, constants, n_temporaries, n_registers,
+             result) = self._get_compiled()
+        if approximate:
+            code = _approximate(code, approximate)
+        inputs = [output for _, output in inputs]
+        outputs = [np.empty(n_samples, dtype=dtype) for _ in stores]
+        constants = [dtype(constant) for constant in constants]
+        if block_size is None:
+            block_size = n_samples
+            if n_samples > _BLOCK_SIZES[0]:
+                block_size = _get_block_size()
+
+        # Programs of only constants need no registers nor blocking
+        output = None
+        if n_registers and n_samples > block_size:
+            # Each block's result is written straight into the output
+            if pool is None:
+                output = np.empty(n_samples, dtype=dtype)
             else:
-                # Lazily evaluate later
-                apply_stack[-1].append(node)
-
-            while len(apply_stack[-1]) == int(apply_stack[-1][0][-1]) + 1:
-                # Apply functions that have sufficient arguments
-                function = FUNCTIONS[apply_stack[-1][0]]
-                terminals = [np.repeat(t, X.shape[0]) if isinstance(t, float)
-                             else X[:, t] if isinstance(t, int)
-                             else t for t in apply_stack[-1][1:]]
-                intermediate_result = function(*terminals)
-                if len(apply_stack) != 1:
-                    apply_stack.pop()
-                    apply_stack[-1].append(intermediate_result)
-                else:
-                    np.seterr(**old_settings)
-                    # Protect for rmsle:
-                    if self.metric == 'rmsle':
-                        intermediate_result[intermediate_result <= 1e-16] = 0
-                    return intermediate_result
+                output = pool.get(1, n_samples, dtype)[0]
+        else:
+            block_size = n_samples
+        if pool is None:
+            registers = [np.empty(block_size, dtype=dtype)
+                         for _ in range(n_registers)]
+        else:
+            registers = pool.get(n_registers, block_size, dtype)
 
-        # We should never get here
-        np.seterr(**old_settings)
-        return None
+        # Stop warnings being raised for protected division, etc
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for start in range(0, n_samples, block_size):
+                stop = min(start + block_size, n_samples)
+                if indices is None:
+                    rows = slice(start, stop)
+                else:
+                    rows = indices[start:stop]
+                slots = ([X[rows, feature] for feature in features] +
+                         [output[start:stop] for output in inputs] +
+                         constants + [None] * n_temporaries +
+                         [output[start:stop] for output in outputs] +
+                         [register[:stop - start] for register in registers])
+                if output is not None:
+                    slots[result] = output[start:stop]
+
+                for function, arguments, destination, buffered in code:
+                    terminals = [slots[arg] for arg in arguments]
+                    if buffered:
+                        function(*terminals, out=slots[destination])
+                    else:
+                        slots[destination] = function(*terminals)
+
+        for (_, key), stored in zip(stores, outputs):
+            if cache is not None:
+                cache.put(key, stored)
+            if keep:
+                kept[key] = stored
+        if keep and indices is None:
+            self._outputs = kept
+        if output is None:
+            output = slots[result]
+            if np.ndim(output) == 0:
+                # Program only depends on constants
+                output = np.repeat(output, n_samples)
+            elif result < len(features):
+                # Program simplifies to a feature, never return a view of X
+                output = output.copy()
+
+        # Protect for rmsle:
+        if self.metric == 'rmsle':
+            output[output <= 1e-16] = 0
+        return output
 
-    def raw_fitness(self, X, y, sample_weight):
+    def raw_fitness(self, X, y, sample_weight, pool=None, indices=None,
+                    cache=None, parents=(), keep=False, y_pred=None,
+                    approximate=False, context=None):
         """Evaluate the raw fitness of the program according to X, y.
 
         Parameters
@@ -559,40 +2541,52 @@ class _Program(object):
         sample_weight : array-like, shape = [n_samples]
             Weights applied to individual samples.
 
-        Returns
-        -------
-        raw_fitness : float
-            The raw fitness of the program.
-        """
-        y_pred = self.execute(X)
+        pool : _BufferPool, optional (default=None)
+            A pool of work buffers to execute the program into.
 
-        if self.metric == 'mean absolute error':
-            raw_fitness = np.average(np.abs(y_pred - y),
-                                     weights=sample_weight)
+        indices : array-like, shape = [n_subsamples], optional (default=None)
+            The rows of `X` to evaluate the program on. If None, all rows are
+            used.
 
-        elif self.metric == 'mse':
-            raw_fitness = np.average(((y_pred - y) ** 2),
-                                     weights=sample_weight)
+        cache : _SubtreeCache, optional (default=None)
+            A cache of the outputs of subtrees to share with other programs.
 
-        elif self.metric == 'rmse':
-            raw_fitness = np.sqrt(np.average(((y_pred - y) ** 2),
-                                             weights=sample_weight))
+        parents : list of _Program, optional
+            Programs whose kept subtree outputs may be reused.
 
-        elif self.metric == 'rmsle':
-            raw_fitness = np.sqrt(np.average((np.log(y_pred + 1) -
-                                              np.log(y + 1)) ** 2,
-                                             weights=sample_weight))
+        keep : bool, optional (default=False)
+            Whether to keep the outputs of the program's subtrees.
 
-        elif self.metric == 'pearson':
-            raw_fitness = weighted_pearson(y_pred, y, sample_weight)
+        y_pred : array-like, shape = [n_samples] or [n_subsamples], optional
+            The result of executing the program on X, if already known. The
+            program is then not executed again.
 
-        elif self.metric == 'spearman':
-            raw_fitness = weighted_spearman(y_pred, y, sample_weight)
+        approximate : bool or dict, optional (default=False)
+            Whether to execute the program with the faster approximations of
+            the transcendental functions, or the approximations to use keyed
+            by the exact functions.
 
-        else:
-            raise ValueError('Unsupported metric: %s' % self.metric)
+        context : _FitnessContext, optional (default=None)
+            The statistics of `y` on the samples the program is evaluated on,
+            shared by the programs evaluated on the same samples. If None,
+            they are computed for this program.
 
-        return raw_fitness
+        Returns
+        -------
+        raw_fitness : float
+            The raw fitness of the program.
+        """
+        if y_pred is None:
+            y_pred = self.execute(X, pool, indices=indices, cache=cache,
+                                  parents=parents, keep=keep,
+                                  approximate=approximate)
+        if context is None:
+            if indices is not None:
+                y = y[indices]
+                sample_weight = sample_weight[indices]
+            context = _FitnessContext(y, sample_weight, self.metric)
+
+        return context(y_pred)
 
     def fitness(self, parsimony_coefficient=None):
         """Evaluate the penalized fitness of the program according to X, y.
@@ -601,7 +2595,9 @@ class _Program(object):
         ----------
         parsimony_coefficient : float, optional
             If automatic parsimony is being used, the computed value according
-            to the population. Otherwise the initialized value is used.
+            to the population. Otherwise the initialized value is used. The
+            length of the program is penalized by the coefficient, and its
+            cost above its length by the magnitude of the coefficient.
 
         Returns
         -------
@@ -610,7 +2606,10 @@ class _Program(object):
         """
         if parsimony_coefficient is None:
             parsimony_coefficient = self.parsimony_coefficient
-        penalty = parsimony_coefficient * len(self.program)
+        # The cost of functions above that of a node is always penalized, even
+        # when automatic parsimony rewards length
+        penalty = (parsimony_coefficient * self.length_ +
+                   abs(parsimony_coefficient) * (self.cost_ - self.length_))
         if self.metric in ('pearson', 'spearman'):
             penalty *= -1
         return self.raw_fitness_ + penalty
@@ -644,7 +2643,7 @@ class _Program(object):
         while stack > end - start:
             node = program[end]
             if isinstance(node, six.string_types):
-                stack += int(node[-1])
+                stack += _ARITIES[node]
             end += 1
 
         return start, end
@@ -767,7 +2766,7 @@ class _Program(object):
 
         for node in mutate:
             if isinstance(program[node], six.string_types):
-                arity = int(program[node][-1])
+                arity = _ARITIES[program[node]]
                 # Find a valid replacement with same arity
                 replacement = len(self.arities[arity])
                 replacement = random_state.randint(replacement)
@@ -784,6 +2783,7 @@ class _Program(object):
 
     depth_ = property(_depth)
     length_ = property(_length)
+    cost_ = property(_cost)
 
 
 class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
@@ -805,6 +2805,13 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
                  const_range=(-1., 1.),
                  init_depth=(2, 6),
                  init_method='half and half',
+                 function_set=None,
+                 max_depth=None,
+                 max_length=None,
+                 function_costs=None,
+                 approximate=False,
+                 dtype=np.float64,
+                 rescore=False,
                  transformer=True,
                  comparison=True,
                  trigonometric=False,
@@ -816,7 +2823,14 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
                  p_point_mutation=0.01,
                  p_point_replace=0.05,
                  max_samples=1.0,
+                 subtree_cache_size=None,
+                 parent_cache_size=None,
+                 n_islands=None,
+                 migration_interval=10,
+                 migration_size=1,
+                 migration_topology='ring',
                  n_jobs=1,
+                 backend='multiprocessing',
                  verbose=0,
                  random_state=None):
 
@@ -829,6 +2843,13 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
         self.const_range = const_range
         self.init_depth = init_depth
         self.init_method = init_method
+        self.function_set = function_set
+        self.max_depth = max_depth
+        self.max_length = max_length
+        self.function_costs = function_costs
+        self.approximate = approximate
+        self.dtype = dtype
+        self.rescore = rescore
         self.transformer = transformer
         self.comparison = comparison
         self.trigonometric = trigonometric
@@ -840,7 +2861,14 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
         self.p_point_mutation = p_point_mutation
         self.p_point_replace = p_point_replace
         self.max_samples = max_samples
+        self.subtree_cache_size = subtree_cache_size
+        self.parent_cache_size = parent_cache_size
+        self.n_islands = n_islands
+        self.migration_interval = migration_interval
+        self.migration_size = migration_size
+        self.migration_topology = migration_topology
         self.n_jobs = n_jobs
+        self.backend = backend
         self.verbose = verbose
         self.random_state = random_state
 
@@ -852,7 +2880,8 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
                           length=None,
                           X=None,
                           y=None,
-                          sample_weight=None):
+                          sample_weight=None,
+                          cache_stats=None):
         """A report of the progress of the evolution process.
 
         Parameters
@@ -881,14 +2910,26 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
 
         sample_weight : array-like, shape = [n_samples], optional
             Weights applied to individual samples.
+
+        cache_stats : tuple of two ints, optional
+            The number of subtrees found in the subtree cache during the
+            current generation, and the number looked up.
         """
+        line_format = '%4s %8s %16s %8s %16s %16s %10s'
+        if self.subtree_cache_size is not None:
+            line_format += ' %10s'
+
         if start_time is None:
             print('%4s|%-25s|%-42s|' % (' ', 'Population Average'.center(25),
                                         'Best Individual'.center(42)))
-            print('-' * 4 + ' ' + '-' * 25 + ' ' + '-' * 42 + ' ' + '-' * 10)
+            rule = '-' * 4 + ' ' + '-' * 25 + ' ' + '-' * 42 + ' ' + '-' * 10
             header_fields = ('Gen', 'Length', 'Fitness', 'Length', 'Fitness',
                              'OOB Fitness', 'Time Left')
-            print('%4s %8s %16s %8s %16s %16s %10s' % header_fields)
+            if self.subtree_cache_size is not None:
+                rule += ' ' + '-' * 10
+                header_fields += ('Cache Hits',)
+            print(rule)
+            print(line_format % header_fields)
 
         else:
             # Estimate remaining time for run
@@ -907,23 +2948,149 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
 
             oob_fitness = 'N/A'
             if self.max_samples < 1.0:
-                # Calculate OOB fitness
+                # Calculate OOB fitness on the samples left out of the bag
                 if sample_weight is None:
-                    curr_sample_weight = np.ones(y.shape)
-                else:
-                    curr_sample_weight = sample_weight.copy()
-                curr_sample_weight[best_program.indices_] = 0
-                oob_fitness = best_program.raw_fitness(X, y,
-                                                       curr_sample_weight)
-
-            print('%4s %8s %16s %8s %16s %16s %10s' %
-                  (gen,
-                   np.round(np.mean(length), 2),
-                   np.mean(fitness),
-                   best_program.length_,
-                   best_program.raw_fitness_,
-                   oob_fitness,
-                   remaining_time))
+                    sample_weight = np.ones(y.shape)
+                oob = np.ones(y.shape, dtype=bool)
+                oob[best_program.indices_] = False
+                oob_fitness = best_program.raw_fitness(
+                    X, y, sample_weight, indices=np.where(oob)[0])
+
+            line_fields = (gen,
+                           np.round(np.mean(length), 2),
+                           np.mean(fitness),
+                           best_program.length_,
+                           best_program.raw_fitness_,
+                           oob_fitness,
+                           remaining_time)
+            if self.subtree_cache_size is not None:
+                cache_hits = 'N/A'
+                if cache_stats is not None and cache_stats[1]:
+                    cache_hits = '{0:.1%}'.format(cache_stats[0] /
+                                                  float(cache_stats[1]))
+                line_fields += (cache_hits,)
+
+            print(line_format % line_fields)
+
+    def _evolve_islands(self, parallel, parents, gen, starts, arrays, params,
+                        random_state):
+        """Evolve the islands from generation `gen` until the next migration.
+
+        Returns the population of each generation, with the number of hits
+        and lookups in the subtree caches.
+        """
+        X, y, sample_weight = arrays
+        n_generations = min(self.migration_interval, self.generations - gen)
+        # Worker processes are done with their subtree cache after the last
+        # generation
+        params['release_cache'] = (self.backend != 'threading' and
+                                   gen + n_generations == self.generations)
+        seeds = random_state.randint(MAX_INT, size=(n_generations,
+                                                    self.population_size))
+        migrants = [None] * self.n_islands
+        if parents is not None:
+            migrants = _migrate(parents, starts, self.metric,
+                                self.migration_size, self.migration_topology,
+                                random_state)
+        results = parallel(
+            delayed(_evolve_island)(
+                None if parents is None else _Population(
+                    [parents[k] for k in migrants[i]],
+                    self._function_set,
+                    [parents[k].fitness_ for k in migrants[i]]),
+                migrants[i],
+                starts[i],
+                X,
+                y,
+                sample_weight,
+                seeds[:, starts[i]:starts[i + 1]],
+                params)
+            for i in range(self.n_islands))
+
+        # Reduce, maintaining the order of the islands
+        epoch = []
+        for k in range(n_generations):
+            population = []
+            for generations, _ in results:
+                population.extend(_decode_population(generations[k], params,
+                                                     self.n_features_,
+                                                     X.shape[0]))
+            cache_stats = np.sum([stats[k] for _, stats in results], axis=0)
+            epoch.append((population, cache_stats))
+        return epoch
+
+    def _evaluate_population(self, parallel, population, lineage, arrays,
+                             shared, fitness_cache, params, n_jobs):
+        """Set the raw fitness of the programs of a generation.
+
+        Returns the number of hits and lookups in the subtree caches.
+        """
+        X, y, sample_weight = arrays
+        if n_jobs == 1:
+            # Evaluated in this process, where the outputs of the parents'
+            # subtrees are at hand
+            return _evaluate_programs(population, X, y, sample_weight,
+                                      fitness_cache, params, lineage)
+
+        # Identical programs are only evaluated once
+        tasks = population
+        if fitness_cache is not None:
+            tasks = OrderedDict()
+            for program in population:
+                fingerprint = program._get_fingerprint()
+                if fingerprint not in fitness_cache:
+                    tasks.setdefault(fingerprint, program)
+            tasks = list(tasks.values())
+
+        # Share out the programs by their cost to evaluate
+        costs = [program.length_ * program.indices_.shape[0]
+                 for program in tasks]
+        jobs = [job for job in _balance_costs(costs, n_jobs) if job]
+        if self.backend == 'threading':
+            # Threads evaluate the programs themselves
+            results = parallel(
+                delayed(_evaluate_programs)(
+                    [tasks[k] for k in job],
+                    X,
+                    y,
+                    sample_weight,
+                    None if fitness_cache is None else {},
+                    params)
+                for job in jobs)
+            results = [([tasks[k].raw_fitness_ for k in job], stats)
+                       for job, stats in zip(jobs, results)]
+        else:
+            X_shared, y_shared, sample_weight_shared = shared
+            in_bag = None
+            if fitness_cache is None:
+                in_bag = [[tasks[k].indices_ for k in job] for job in jobs]
+            results = parallel(
+                delayed(_parallel_evaluate)(
+                    _Population([tasks[k] for k in job],
+                                self._function_set,
+                                in_bag=None if in_bag is None else in_bag[j],
+                                n_samples=X.shape[0]),
+                    X_shared,
+                    y_shared,
+                    sample_weight_shared,
+                    None if fitness_cache is None else {},
+                    params)
+                for j, job in enumerate(jobs))
+
+        # Reduce, maintaining the order of the programs
+        cache_stats = [(0, 0)]
+        for job, (fitness, stats) in zip(jobs, results):
+            for k, raw_fitness in zip(job, fitness):
+                tasks[k].raw_fitness_ = raw_fitness
+            cache_stats.append(stats)
+        if fitness_cache is not None:
+            for program in tasks:
+                fitness_cache[program._get_fingerprint()] = (
+                    program.raw_fitness_)
+            for program in population:
+                program.raw_fitness_ = fitness_cache[
+                    program._get_fingerprint()]
+        return np.sum(cache_stats, axis=0)
 
     def fit(self, X, y, sample_weight=None):
         """Fit the Genetic Program according to X, y.
@@ -947,8 +3114,9 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
         """
         random_state = check_random_state(self.random_state)
 
-        # Check arrays
-        X, y = check_X_y(X, y, y_numeric=True)
+        # Check arrays, programs read X one feature at a time so store it
+        # feature-major for contiguous access
+        X, y = check_X_y(X, y, y_numeric=True, order='F')
         _, self.n_features_ = X.shape
 
         hall_of_fame = self.hall_of_fame
@@ -966,19 +3134,33 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
                              'hall_of_fame (%d).' % (self.n_components,
                                                      self.hall_of_fame))
 
-        self._function_set = ['add2', 'sub2', 'mul2', 'div2']
-        if self.transformer:
-            self._function_set.extend(['sqrt1', 'log1', 'abs1', 'neg1',
-                                       'inv1'])
-        if self.comparison:
-            self._function_set.extend(['max2', 'min2'])
-        if self.trigonometric:
-            self._function_set.extend(['sin1', 'cos1', 'tan1'])
+        if self.function_set is not None:
+            self._function_set = list(self.function_set)
+            if not self._function_set:
+                raise ValueError('function_set should include at least one '
+                                 'function.')
+            for function in self._function_set:
+                if function not in FUNCTIONS:
+                    raise ValueError('Unsupported function in function_set: '
+                                     '%s' % function)
+        else:
+            self._function_set = ['add2', 'sub2', 'mul2', 'div2']
+            if self.transformer:
+                self._function_set.extend(['sqrt1', 'log1', 'abs1', 'neg1',
+                                           'inv1'])
+            if self.comparison:
+                self._function_set.extend(['max2', 'min2'])
+            if self.trigonometric:
+                self._function_set.extend(['sin1', 'cos1', 'tan1'])
+        # The registered functions travel with the fitted estimator
+        self._functions = dict((function, FUNCTIONS[function])
+                               for function in self._function_set
+                               if isinstance(FUNCTIONS[function], _Function))
 
         # For point-mutation to find a compatible replacement node
         self._arities = {}
         for function in self._function_set:
-            arity = int(function[-1])
+            arity = _ARITIES[function]
             self._arities[arity] = self._arities.get(arity, [])
             self._arities[arity].append(function)
 
@@ -1011,6 +3193,36 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
                 len(self.const_range) != 2):
             raise ValueError('const_range should be a tuple with length two.')
 
+        if (self.subtree_cache_size is not None and
+                self.subtree_cache_size <= 0):
+            raise ValueError('subtree_cache_size should be positive or None.')
+
+        if (self.parent_cache_size is not None and
+                self.parent_cache_size <= 0):
+            raise ValueError('parent_cache_size should be positive or None.')
+
+        if self.backend not in ('multiprocessing', 'threading'):
+            raise ValueError('Valid backends include "multiprocessing" and '
+                             '"threading". Given %s.' % self.backend)
+
+        if self.n_islands is not None:
+            if self.n_islands < 2:
+                raise ValueError('n_islands should be at least 2 or None.')
+            if self.migration_interval < 1:
+                raise ValueError('migration_interval should be positive.')
+            if self.migration_topology not in ('ring', 'random', 'full'):
+                raise ValueError('Valid migration topologies include "ring", '
+                                 '"random" and "full". Given %s.'
+                                 % self.migration_topology)
+            n_migrants = self.migration_size
+            if self.migration_topology == 'full':
+                n_migrants *= self.n_islands - 1
+            if (self.migration_size < 1 or
+                    n_migrants >= self.population_size // self.n_islands):
+                raise ValueError('migration_size should be positive, and '
+                                 'islands should receive fewer programs than '
+                                 'they hold.')
+
         if (not isinstance(self.init_depth, tuple) or
                 len(self.init_depth) != 2):
             raise ValueError('init_depth should be a tuple with length two.')
@@ -1018,69 +3230,220 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
             raise ValueError('init_depth should be in increasing numerical '
                              'order: (min_depth, max_depth).')
 
+        if self.max_depth is not None and self.max_depth < self.init_depth[1]:
+            raise ValueError('max_depth (%d) must be greater than or equal to '
+                             'the maximum init_depth (%d).'
+                             % (self.max_depth, self.init_depth[1]))
+        if (self.max_length is not None and
+                self.max_length < 1 + max(self._arities)):
+            raise ValueError('max_length (%d) is too short to hold any '
+                             'program, it must be at least %d.'
+                             % (self.max_length, 1 + max(self._arities)))
+
+        function_costs = self.function_costs
+        if function_costs == 'auto':
+            function_costs = _get_function_costs()
+        if function_costs is not None:
+            if not isinstance(function_costs, dict):
+                raise ValueError('function_costs should be a dict, "auto" or '
+                                 'None.')
+            for function, cost in function_costs.items():
+                if function not in FUNCTIONS:
+                    raise ValueError('Unsupported function in '
+                                     'function_costs: %s' % function)
+                if not cost > 0:
+                    raise ValueError('The cost of %s must be positive, got '
+                                     '%s.' % (function, cost))
+            costs = {}
+            for function in self._function_set:
+                cost = function_costs.get(function,
+                                          getattr(FUNCTIONS[function], 'cost',
+                                                  None))
+                if cost is not None:
+                    costs[function] = float(cost)
+            function_costs = costs
+
+        if np.dtype(self.dtype) not in (np.float32, np.float64):
+            raise ValueError('dtype should be np.float32 or np.float64, got '
+                             '%s.' % self.dtype)
+        if self.approximate == 'rescore':
+            raise ValueError('approximate="rescore" has been replaced by '
+                             'approximate=True with rescore=True.')
+        if self.approximate not in (True, False):
+            raise ValueError('approximate should be a bool, got %s.'
+                             % self.approximate)
+        if self.rescore not in (True, False):
+            raise ValueError('rescore should be a bool, got %s.'
+                             % self.rescore)
+        # Keep the data at full precision to score the final programs
+        X_full, y_full, sample_weight_full = X, y, sample_weight
+        X = np.asfortranarray(X, dtype=self.dtype)
+        y = np.asarray(y, dtype=self.dtype)
+        if sample_weight is not None:
+            sample_weight = np.asarray(sample_weight, dtype=self.dtype)
+
         params = self.get_params()
         params['function_set'] = self._function_set
+        params['function_costs'] = function_costs
+        params['functions'] = self._functions
         params['arities'] = self._arities
         params['method_probs'] = self._method_probs
+        if self.approximate:
+            # Choose the approximations once, so that every job of the fit
+            # evaluates programs alike
+            params['approximate'] = _get_approximations()
+        # Identifies this fit's subtree caches in the worker processes
+        params['cache_key'] = uuid4().hex
+        # Set for the jobs of the last generation, after which worker
+        # processes free their subtree cache
+        params['release_cache'] = False
+        if self.n_jobs != 1:
+            # Kept outputs are dropped when programs are sent to other
+            # processes, so there is no point in keeping them
+            if self.parent_cache_size is not None:
+                warnings.warn('parent_cache_size has no effect unless n_jobs '
+                              'is 1, no outputs will be kept.')
+            params['parent_cache_size'] = None
 
         self._programs = []
 
+        # Programs evaluated on all of the samples share their raw fitness
+        # with identical offspring, over the last couple of generations
+        fitness_cache = None
+        if (int(self.max_samples * X.shape[0]) == X.shape[0] and
+                self.n_islands is None):
+            fitness_cache = OrderedDict()
+
+        # The programs of each island, in every generation
+        starts = [0, self.population_size]
+        if self.n_islands is not None:
+            _, _, starts = _partition_estimators(self.population_size,
+                                                 self.n_islands)
+        # The generations evolved by the islands, yet to be reported
+        epoch = []
+
         if self.verbose:
             # Print header fields
             self._verbose_reporter()
             start_time = time()
 
-        for gen in range(self.generations):
-
-            if gen == 0:
-                parents = None
-            else:
-                parents = self._programs[gen - 1]
-
-            # Parallel loop
-            n_jobs, n_programs, starts = _partition_estimators(
-                self.population_size, self.n_jobs)
-            seeds = random_state.randint(MAX_INT, size=self.population_size)
-
-            population = Parallel(n_jobs=n_jobs,
-                                  verbose=int(self.verbose > 1))(
-                delayed(_parallel_evolve)(n_programs[i],
-                                          parents,
-                                          X,
-                                          y,
-                                          sample_weight,
-                                          seeds[starts[i]:starts[i + 1]],
-                                          params)
-                for i in range(n_jobs))
-
-            # Reduce, maintaining order across different n_jobs
-            population = list(itertools.chain.from_iterable(population))
-
-            fitness = [program.raw_fitness_ for program in population]
-            length = [program.length_ for program in population]
-
-            parsimony_coefficient = None
-            if self.parsimony_coefficient == 'auto':
-                parsimony_coefficient = (np.cov(length, fitness)[1, 0] /
-                                         np.var(length))
+        # The same workers are used for every generation, and the data is
+        # shared with worker processes once for the whole fit
+        n_jobs = min(_get_n_jobs(self.n_jobs), self.population_size)
+        use_threads = self.backend == 'threading'
+        if use_threads and n_jobs > 1:
+            # Take the measurements made on first use before the threads
+            # start, rather than timing them against each other
+            _get_block_size()
+        data = _SharedArrays([X, y, sample_weight],
+                             share=n_jobs > 1 and not use_threads)
+        try:
+            # The workers are shut down before the data they share is deleted
+            with data:
+                with Parallel(n_jobs=n_jobs, backend=self.backend,
+                              verbose=int(self.verbose > 1)) as parallel:
+                    for gen in range(self.generations):
+
+                        if gen == 0:
+                            parents = None
+                        else:
+                            parents = self._programs[gen - 1]
+
+                        if self.n_islands is not None:
+                            if not epoch:
+                                epoch = self._evolve_islands(
+                                    parallel, parents, gen, starts,
+                                    data.arrays, params, random_state)
+                            population, cache_stats = epoch.pop(0)
+                        else:
+                            # Breeding is cheap and done here, with a seed
+                            # per program
+                            seeds = random_state.randint(
+                                MAX_INT, size=self.population_size)
+                            population, lineage = _breed_programs(
+                                parents, X.shape[0], self.n_features_, seeds,
+                                params)
+
+                            # Worker processes are done with their subtree
+                            # cache after the last generation
+                            params['release_cache'] = (
+                                gen == self.generations - 1)
+                            cache_stats = self._evaluate_population(
+                                parallel, population, lineage,
+                                [X, y, sample_weight], data.arrays,
+                                fitness_cache, params, n_jobs)
+
+                            if fitness_cache is not None:
+                                # Refresh the cache, evicting the least
+                                # recently seen programs
+                                for program in population:
+                                    fingerprint = program._get_fingerprint()
+                                    fitness_cache.pop(fingerprint, None)
+                                    fitness_cache[fingerprint] = (
+                                        program.raw_fitness_)
+                                while (len(fitness_cache) >
+                                       2 * self.population_size):
+                                    fitness_cache.popitem(last=False)
+
+                        if parents is not None:
+                            # Only the latest generation's outputs are
+                            # needed now
+                            for program in parents:
+                                program._outputs = None
+
+                        fitness = [program.raw_fitness_
+                                   for program in population]
+                        length = [program.length_ for program in population]
+
+                        # Parsimony is weighed within each island
+                        for i in range(len(starts) - 1):
+                            _penalize(population[starts[i]:starts[i + 1]],
+                                      self.parsimony_coefficient)
+
+                        self._programs.append(population)
+
+                        if self.verbose:
+                            self._verbose_reporter(start_time, gen, population,
+                                                   fitness, length, X, y,
+                                                   sample_weight, cache_stats)
+
+                        # Check for early stopping
+                        if self.metric in ('pearson', 'spearman'):
+                            best_fitness = fitness[np.argmax(fitness)]
+                            if best_fitness >= self.stopping_criteria:
+                                break
+                        else:
+                            best_fitness = fitness[np.argmin(fitness)]
+                            if best_fitness <= self.stopping_criteria:
+                                break
+        finally:
+            # Jobs run in this process keep their subtree cache here, free it
+            # even if the evolution is interrupted
+            _release_subtree_cache(params['cache_key'])
+            if self._programs:
+                for program in self._programs[-1]:
+                    program._outputs = None
+
+        if self.rescore:
+            # Choose from the final generation by its exact fitness
+            X = np.asfortranarray(X_full, dtype=np.float64)
+            y = np.asarray(y_full, dtype=np.float64)
+            sample_weight = sample_weight_full
+            if sample_weight is None:
+                sample_weight = np.ones(y.shape)
+            population = self._programs[-1]
+            context = _FitnessContext(y, sample_weight, self.metric)
             for program in population:
-                program.fitness_ = program.fitness(parsimony_coefficient)
-
-            self._programs.append(population)
-
-            if self.verbose:
-                self._verbose_reporter(start_time, gen, population, fitness,
-                                       length, X, y, sample_weight)
-
-            # Check for early stopping
-            if self.metric in ('pearson', 'spearman'):
-                best_fitness = fitness[np.argmax(fitness)]
-                if best_fitness >= self.stopping_criteria:
-                    break
-            else:
-                best_fitness = fitness[np.argmin(fitness)]
-                if best_fitness <= self.stopping_criteria:
-                    break
+                if program.indices_.shape[0] < X.shape[0]:
+                    program.raw_fitness_ = program.raw_fitness(
+                        X, y, sample_weight, indices=program.indices_)
+                else:
+                    program.raw_fitness_ = program.raw_fitness(
+                        X, y, sample_weight, context=context)
+            fitness = [program.raw_fitness_ for program in population]
+            for i in range(len(starts) - 1):
+                _penalize(population[starts[i]:starts[i + 1]],
+                          self.parsimony_coefficient)
 
         if isinstance(self, RegressorMixin):
             # Find the best individual in the final generation
@@ -1090,16 +3453,16 @@ class BaseSymbolic(six.with_metaclass(ABCMeta, BaseEstimator)):
             # Find the best individuals in the final generation
             fitness = np.array(fitness)
             hall_of_fame = fitness.argsort()[:self.hall_of_fame]
-            evaluation = np.array([gp.execute(X) for gp in
-                                   [self._programs[-1][i] for
-                                    i in hall_of_fame]])
+            evaluation = np.empty((len(hall_of_fame), X.shape[0]))
+            for i, output in _execute_population(
+                    [self._programs[-1][i] for i in hall_of_fame], X):
+                evaluation[i] = output
             if self.metric == 'spearman':
                 evaluation = np.apply_along_axis(rankdata, 1, evaluation)
 
             # Iteratively remove the worst individual of the worst pair
-            old_settings = np.seterr(divide='ignore', invalid='ignore')
-            correlations = np.abs(np.corrcoef(evaluation))
-            np.seterr(**old_settings)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                correlations = np.abs(np.corrcoef(evaluation))
             np.fill_diagonal(correlations, 0.)
             components = list(range(self.hall_of_fame))
             indices = list(range(self.hall_of_fame))
@@ -1162,6 +3525,63 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
         - 'half and half' : Trees are grown through a 50/50 mix of 'full' and
           'grow', making for a mix of tree shapes in the initial population.
 
+    function_set : iterable of str or None, optional (default=None)
+        The names of the functions to build programs from, which may include
+        the built-in functions 'add2', 'sub2', 'mul2', 'div2', 'sqrt1',
+        'log1', 'abs1', 'neg1', 'inv1', 'max2', 'min2', 'sin1', 'cos1' and
+        'tan1', as well as functions made available with `register_function`.
+        If None, the function set is chosen by the `transformer`,
+        `comparison` and `trigonometric` parameters, which are otherwise
+        ignored.
+
+    max_depth : integer or None, optional (default=None)
+        The maximum depth of the programs in every generation, which must be
+        at least the maximum of `init_depth`. Offspring of crossover and
+        subtree mutation that exceed it have their genetic operation re-drawn
+        a few times, after which the parent is reproduced instead. Together
+        with `max_length` this bounds the cost of evaluating a generation. If
+        None, the depth is unbounded.
+
+    max_length : integer or None, optional (default=None)
+        The maximum number of functions and terminals in the programs in every
+        generation. The initial population is grown within it, and offspring
+        that exceed it are handled as for `max_depth`. If None, the length is
+        unbounded.
+
+    function_costs : dict, "auto" or None, optional (default=None)
+        The cost of each function when measuring the size of programs for the
+        parsimony penalty, whether fixed or "auto". Terminals cost 1.0.
+
+        - dict : Costs of the form `{function name: cost}`, functions missing
+          from the dict cost as registered with `register_function`, or 1.0.
+        - "auto" : Costs are measured by timing each function relative to
+          'add2' on first use, or as registered with `register_function`,
+          steering evolution towards programs that are cheap to evaluate.
+          Measured costs vary between machines and runs,
+          so results may not be reproducible with a fixed `random_state`.
+        - None : Every function costs 1.0, so the size is the program length.
+
+    approximate : bool, optional (default=False)
+        Whether to evaluate the sine, cosine, tangent and protected log
+        functions with faster polynomial approximations during evolution,
+        accurate to about 1e-7. Each approximation is only used where it is
+        measured to be faster than NumPy's exact function, on first use in the
+        process, and the same ones are used by every job of the fit. Measured
+        speeds vary between machines and runs, so results may not be
+        reproducible with a fixed `random_state`. Predictions and
+        transformations of the fitted estimator are always exact.
+
+    dtype : np.float32 or np.float64, optional (default=np.float64)
+        The floating point type that `X`, `y`, `sample_weight` and the
+        intermediate results of programs are evaluated in, for fitting as
+        well as for predictions and transformations. Single precision halves
+        the memory traffic of evaluating programs.
+
+    rescore : bool, optional (default=False)
+        Whether to score the final generation again, exactly and in double
+        precision, before the best programs are chosen from it. Only useful
+        with `approximate` or a `dtype` of np.float32.
+
     transformer : bool, optional (default=True)
         Whether to include protected square root, protected log, absolute
         value, negative, and inverse functions in the function set.
@@ -1196,6 +3616,11 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
         program size l and program fitness f in the population, and Var(l) is
         the variance of program sizes.
 
+        Program sizes are weighted by `function_costs`. With "auto", c is
+        computed on program lengths, and the cost of functions above that of
+        a terminal is penalized by the magnitude of c, so that expensive
+        functions are selected against even when c is negative.
+
     p_crossover : float, optional (default=0.9)
         The probability of performing crossover on a tournament winner.
         Crossover takes the winner of a tournament and selects a random subtree
@@ -1237,10 +3662,70 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
     max_samples : float, optional (default=1.0)
         The fraction of samples to draw from X to evaluate each program on.
 
+    subtree_cache_size : float or None, optional (default=None)
+        The memory, in megabytes, that each job may use to keep the evaluated
+        outputs of subtrees for reuse across programs and generations.
+        Offspring inherit most of their subtrees from their parents, and
+        these need not be evaluated again while they remain in the cache. The
+        least recently used outputs are evicted first. Only used when
+        `max_samples` is 1.0, the fraction of subtrees found in the cache is
+        reported in the verbose output. If None, no outputs are kept. Worker
+        processes free their cache after the last generation, but when the
+        fit stops early it is kept until the process is used by another fit
+        or shut down. With `n_jobs` > 1 each job has a cache of its own, and
+        programs are shared out between the jobs by their cost to evaluate
+        rather than sent to the job that evaluated their parents, so fewer
+        subtrees are found in the cache.
+
+    parent_cache_size : float or None, optional (default=None)
+        The memory, in megabytes, that each job may use to keep the evaluated
+        outputs of the subtrees of the programs in the current generation.
+        Offspring then only evaluate the nodes changed by their genetic
+        operation and the path from those to the root, reusing the outputs of
+        their parents for everything else. Programs that would not fit in
+        the remaining memory are evaluated as usual. Only used when
+        `max_samples` is 1.0 and `n_jobs` is 1. If None, no outputs are kept.
+
+    n_islands : integer or None, optional (default=None)
+        The number of islands, or sub-populations, that the population is
+        split into. Each island evolves on its own, in a job of its own, for
+        `migration_interval` generations at a time. Then the fittest programs
+        of each island migrate to the islands it is connected to, where they
+        replace the least fit programs. Only the migrants are exchanged
+        between the islands, which lets the evolution use many more jobs.
+        Tournaments, and the 'auto' `parsimony_coefficient`, only consider
+        the programs of one island. If None, the population evolves as a
+        whole.
+
+    migration_interval : integer, optional (default=10)
+        The number of generations between migrations, if `n_islands` is set.
+
+    migration_size : integer, optional (default=1)
+        The number of programs that each island sends to each of the islands
+        it is connected to, if `n_islands` is set.
+
+    migration_topology : str, optional (default='ring')
+        How the islands are connected, if `n_islands` is set:
+
+        - 'ring' : each island sends migrants to the next one.
+        - 'random' : each island receives migrants from another one, drawn
+          at random at every migration.
+        - 'full' : each island sends migrants to all of the others.
+
     n_jobs : integer, optional (default=1)
         The number of jobs to run in parallel for `fit`. If -1, then the number
         of jobs is set to the number of cores.
 
+    backend : str, optional (default='multiprocessing')
+        How the jobs are run in parallel:
+
+        - 'multiprocessing' : in worker processes, which are sent the
+          programs to evaluate and share the data through memory maps.
+        - 'threading' : in threads of this process, which evaluate the
+          programs in place. NumPy releases the GIL while computing the
+          functions on large arrays, so this avoids starting processes and
+          pickling programs, and needs no extra memory for the workers.
+
     verbose : int, optional (default=0)
         Controls the verbosity of the evolution building process.
 
@@ -1269,6 +3754,13 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
                  const_range=(-1., 1.),
                  init_depth=(2, 6),
                  init_method='half and half',
+                 function_set=None,
+                 max_depth=None,
+                 max_length=None,
+                 function_costs=None,
+                 approximate=False,
+                 dtype=np.float64,
+                 rescore=False,
                  transformer=True,
                  comparison=True,
                  trigonometric=False,
@@ -1280,7 +3772,14 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
                  p_point_mutation=0.01,
                  p_point_replace=0.05,
                  max_samples=1.0,
+                 subtree_cache_size=None,
+                 parent_cache_size=None,
+                 n_islands=None,
+                 migration_interval=10,
+                 migration_size=1,
+                 migration_topology='ring',
                  n_jobs=1,
+                 backend='multiprocessing',
                  verbose=0,
                  random_state=None):
         super(SymbolicRegressor, self).__init__(
@@ -1291,6 +3790,13 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
             const_range=const_range,
             init_depth=init_depth,
             init_method=init_method,
+            function_set=function_set,
+            max_depth=max_depth,
+            max_length=max_length,
+            function_costs=function_costs,
+            approximate=approximate,
+            dtype=dtype,
+            rescore=rescore,
             transformer=transformer,
             comparison=comparison,
             trigonometric=trigonometric,
@@ -1302,7 +3808,14 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
             p_point_mutation=p_point_mutation,
             p_point_replace=p_point_replace,
             max_samples=max_samples,
+            subtree_cache_size=subtree_cache_size,
+            parent_cache_size=parent_cache_size,
+            n_islands=n_islands,
+            migration_interval=migration_interval,
+            migration_size=migration_size,
+            migration_topology=migration_topology,
             n_jobs=n_jobs,
+            backend=backend,
             verbose=verbose,
             random_state=random_state)
 
@@ -1328,8 +3841,9 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
         """
         if not hasattr(self, "_program"):
             raise NotFittedError("SymbolicRegressor not fitted.")
+        _install_functions(self._functions, replace=False)
 
-        X = check_array(X)
+        X = check_array(X, dtype=self.dtype, order='F')
         _, n_features = X.shape
         if self.n_features_ != n_features:
             raise ValueError("Number of features of the model must match the "
@@ -1399,6 +3913,63 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
         - 'half and half' : Trees are grown through a 50/50 mix of 'full' and
           'grow', making for a mix of tree shapes in the initial population.
 
+    function_set : iterable of str or None, optional (default=None)
+        The names of the functions to build programs from, which may include
+        the built-in functions 'add2', 'sub2', 'mul2', 'div2', 'sqrt1',
+        'log1', 'abs1', 'neg1', 'inv1', 'max2', 'min2', 'sin1', 'cos1' and
+        'tan1', as well as functions made available with `register_function`.
+        If None, the function set is chosen by the `transformer`,
+        `comparison` and `trigonometric` parameters, which are otherwise
+        ignored.
+
+    max_depth : integer or None, optional (default=None)
+        The maximum depth of the programs in every generation, which must be
+        at least the maximum of `init_depth`. Offspring of crossover and
+        subtree mutation that exceed it have their genetic operation re-drawn
+        a few times, after which the parent is reproduced instead. Together
+        with `max_length` this bounds the cost of evaluating a generation. If
+        None, the depth is unbounded.
+
+    max_length : integer or None, optional (default=None)
+        The maximum number of functions and terminals in the programs in every
+        generation. The initial population is grown within it, and offspring
+        that exceed it are handled as for `max_depth`. If None, the length is
+        unbounded.
+
+    function_costs : dict, "auto" or None, optional (default=None)
+        The cost of each function when measuring the size of programs for the
+        parsimony penalty, whether fixed or "auto". Terminals cost 1.0.
+
+        - dict : Costs of the form `{function name: cost}`, functions missing
+          from the dict cost as registered with `register_function`, or 1.0.
+        - "auto" : Costs are measured by timing each function relative to
+          'add2' on first use, or as registered with `register_function`,
+          steering evolution towards programs that are cheap to evaluate.
+          Measured costs vary between machines and runs,
+          so results may not be reproducible with a fixed `random_state`.
+        - None : Every function costs 1.0, so the size is the program length.
+
+    approximate : bool, optional (default=False)
+        Whether to evaluate the sine, cosine, tangent and protected log
+        functions with faster polynomial approximations during evolution,
+        accurate to about 1e-7. Each approximation is only used where it is
+        measured to be faster than NumPy's exact function, on first use in the
+        process, and the same ones are used by every job of the fit. Measured
+        speeds vary between machines and runs, so results may not be
+        reproducible with a fixed `random_state`. Predictions and
+        transformations of the fitted estimator are always exact.
+
+    dtype : np.float32 or np.float64, optional (default=np.float64)
+        The floating point type that `X`, `y`, `sample_weight` and the
+        intermediate results of programs are evaluated in, for fitting as
+        well as for predictions and transformations. Single precision halves
+        the memory traffic of evaluating programs.
+
+    rescore : bool, optional (default=False)
+        Whether to score the final generation again, exactly and in double
+        precision, before the best programs are chosen from it. Only useful
+        with `approximate` or a `dtype` of np.float32.
+
     transformer : bool, optional (default=True)
         Whether to include protected square root, protected log, absolute
         value, negative, and protected inverse functions in the function set.
@@ -1431,6 +4002,11 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
         program size l and program fitness f in the population, and Var(l) is
         the variance of program sizes.
 
+        Program sizes are weighted by `function_costs`. With "auto", c is
+        computed on program lengths, and the cost of functions above that of
+        a terminal is penalized by the magnitude of c, so that expensive
+        functions are selected against even when c is negative.
+
     p_crossover : float, optional (default=0.9)
         The probability of performing crossover on a tournament winner.
         Crossover takes the winner of a tournament and selects a random subtree
@@ -1472,10 +4048,70 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
     max_samples : float, optional (default=1.0)
         The fraction of samples to draw from X to evaluate each program on.
 
+    subtree_cache_size : float or None, optional (default=None)
+        The memory, in megabytes, that each job may use to keep the evaluated
+        outputs of subtrees for reuse across programs and generations.
+        Offspring inherit most of their subtrees from their parents, and
+        these need not be evaluated again while they remain in the cache. The
+        least recently used outputs are evicted first. Only used when
+        `max_samples` is 1.0, the fraction of subtrees found in the cache is
+        reported in the verbose output. If None, no outputs are kept. Worker
+        processes free their cache after the last generation, but when the
+        fit stops early it is kept until the process is used by another fit
+        or shut down. With `n_jobs` > 1 each job has a cache of its own, and
+        programs are shared out between the jobs by their cost to evaluate
+        rather than sent to the job that evaluated their parents, so fewer
+        subtrees are found in the cache.
+
+    parent_cache_size : float or None, optional (default=None)
+        The memory, in megabytes, that each job may use to keep the evaluated
+        outputs of the subtrees of the programs in the current generation.
+        Offspring then only evaluate the nodes changed by their genetic
+        operation and the path from those to the root, reusing the outputs of
+        their parents for everything else. Programs that would not fit in
+        the remaining memory are evaluated as usual. Only used when
+        `max_samples` is 1.0 and `n_jobs` is 1. If None, no outputs are kept.
+
+    n_islands : integer or None, optional (default=None)
+        The number of islands, or sub-populations, that the population is
+        split into. Each island evolves on its own, in a job of its own, for
+        `migration_interval` generations at a time. Then the fittest programs
+        of each island migrate to the islands it is connected to, where they
+        replace the least fit programs. Only the migrants are exchanged
+        between the islands, which lets the evolution use many more jobs.
+        Tournaments, and the 'auto' `parsimony_coefficient`, only consider
+        the programs of one island. If None, the population evolves as a
+        whole.
+
+    migration_interval : integer, optional (default=10)
+        The number of generations between migrations, if `n_islands` is set.
+
+    migration_size : integer, optional (default=1)
+        The number of programs that each island sends to each of the islands
+        it is connected to, if `n_islands` is set.
+
+    migration_topology : str, optional (default='ring')
+        How the islands are connected, if `n_islands` is set:
+
+        - 'ring' : each island sends migrants to the next one.
+        - 'random' : each island receives migrants from another one, drawn
+          at random at every migration.
+        - 'full' : each island sends migrants to all of the others.
+
     n_jobs : integer, optional (default=1)
         The number of jobs to run in parallel for `fit`. If -1, then the number
         of jobs is set to the number of cores.
 
+    backend : str, optional (default='multiprocessing')
+        How the jobs are run in parallel:
+
+        - 'multiprocessing' : in worker processes, which are sent the
+          programs to evaluate and share the data through memory maps.
+        - 'threading' : in threads of this process, which evaluate the
+          programs in place. NumPy releases the GIL while computing the
+          functions on large arrays, so this avoids starting processes and
+          pickling programs, and needs no extra memory for the workers.
+
     verbose : int, optional (default=0)
         Controls the verbosity of the evolution building process.
 
@@ -1506,6 +4142,13 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                  const_range=(-1., 1.),
                  init_depth=(2, 6),
                  init_method='half and half',
+                 function_set=None,
+                 max_depth=None,
+                 max_length=None,
+                 function_costs=None,
+                 approximate=False,
+                 dtype=np.float64,
+                 rescore=False,
                  transformer=True,
                  comparison=True,
                  trigonometric=False,
@@ -1517,7 +4160,14 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                  p_point_mutation=0.01,
                  p_point_replace=0.05,
                  max_samples=1.0,
+                 subtree_cache_size=None,
+                 parent_cache_size=None,
+                 n_islands=None,
+                 migration_interval=10,
+                 migration_size=1,
+                 migration_topology='ring',
                  n_jobs=1,
+                 backend='multiprocessing',
                  verbose=0,
                  random_state=None):
         super(SymbolicTransformer, self).__init__(
@@ -1530,6 +4180,13 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
             const_range=const_range,
             init_depth=init_depth,
             init_method=init_method,
+            function_set=function_set,
+            max_depth=max_depth,
+            max_length=max_length,
+            function_costs=function_costs,
+            approximate=approximate,
+            dtype=dtype,
+            rescore=rescore,
             transformer=transformer,
             comparison=comparison,
             trigonometric=trigonometric,
@@ -1541,7 +4198,14 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
             p_point_mutation=p_point_mutation,
             p_point_replace=p_point_replace,
             max_samples=max_samples,
+            subtree_cache_size=subtree_cache_size,
+            parent_cache_size=parent_cache_size,
+            n_islands=n_islands,
+            migration_interval=migration_interval,
+            migration_size=migration_size,
+            migration_topology=migration_topology,
             n_jobs=n_jobs,
+            backend=backend,
             verbose=verbose,
             random_state=random_state)
 
@@ -1580,8 +4244,9 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
         """
         if not hasattr(self, "_best_programs"):
             raise NotFittedError("SymbolicTransformer not fitted.")
+        _install_functions(self._functions, replace=False)
 
-        X = check_array(X)
+        X = check_array(X, dtype=self.dtype, order='F')
         _, n_features = X.shape
         if self.n_features_ != n_features:
             raise ValueError("Number of features of the model must match the "
@@ -1589,7 +4254,10 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                              "n_features is %s."
                              % (self.n_features_, n_features))
 
-        X_new = np.array([gp.execute(X) for gp in self._best_programs]).T
+        X_new = np.empty((X.shape[0], len(self._best_programs)),
+                         dtype=X.dtype, order='F')
+        for i, output in _execute_population(self._best_programs, X):
+            X_new[:, i] = output
 
         return X_new
 
@@ -212,6 +212,78 @@ except ImportError:
             yield tuple(pool[i] for i in indices)
 
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    # collections.OrderedDict was introduced in Python 2.7
+    class OrderedDict(dict):
+        """Dictionary that remembers the order in which keys were inserted.
+
+        A minimal backport for Python 2.6, keeping the keys in a list
+        alongside the dict. Removing a key takes time linear in the number
+        of keys.
+        """
+
+        def __init__(self, items=()):
+            dict.__init__(self)
+            self._keys = []
+            if isinstance(items, dict):
+                items = items.items()
+            for key, value in items:
+                self[key] = value
+
+        def __setitem__(self, key, value):
+            if key not in self:
+                self._keys.append(key)
+            dict.__setitem__(self, key, value)
+
+        def __delitem__(self, key):
+            dict.__delitem__(self, key)
+            self._keys.remove(key)
+
+        def __iter__(self):
+            return iter(self._keys)
+
+        def __reduce__(self):
+            return self.__class__, (self.items(),)
+
+        def keys(self):
+            return list(self._keys)
+
+        def values(self):
+            return [self[key] for key in self._keys]
+
+        def items(self):
+            return [(key, self[key]) for key in self._keys]
+
+        def clear(self):
+            dict.clear(self)
+            del self._keys[:]
+
+        def copy(self):
+            return self.__class__(self.items())
+
+        def setdefault(self, key, default=None):
+            if key not in self:
+                self[key] = default
+            return self[key]
+
+        def pop(self, key, *default):
+            if key not in self:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            value = self[key]
+            del self[key]
+            return value
+
+        def popitem(self, last=True):
+            if not self._keys:
+                raise KeyError('dictionary is empty')
+            key = self._keys[-1] if last else self._keys[0]
+            return key, self.pop(key)
+
+
 try:
     from numpy import isclose
 except ImportError:
@@ -7,10 +7,21 @@ gplearn.genetic.SymbolicRegressor and gplearn.genetic.SymbolicTransformer."""
 # License: BSD 3 clause
 
 import numpy as np
+import os
 import pickle
+import shutil
 import sys
+import threading
 
+from gplearn import genetic
 from gplearn.genetic import _Program, SymbolicRegressor, SymbolicTransformer
+from gplearn.genetic import _BufferPool, _SubtreeCache, FUNCTIONS
+from gplearn.genetic import _compile_population, _execute_population
+from gplearn.genetic import _FitnessContext, _Population, _SharedArrays
+from gplearn.genetic import _balance_costs
+from gplearn.genetic import _simplify, register_function
+from gplearn.genetic import _APPROXIMATIONS, _get_approximations
+from gplearn.genetic import protected_log
 from gplearn.genetic import weighted_pearson, weighted_spearman
 
 from scipy.stats import pearsonr, spearmanr
@@ -27,7 +38,8 @@ from gplearn.skutils.testing import assert_false, assert_true
 from gplearn.skutils.testing import assert_greater
 from gplearn.skutils.testing import assert_equal, assert_almost_equal
 from gplearn.skutils.testing import assert_array_almost_equal
-from gplearn.skutils.testing import assert_raises
+from gplearn.skutils.testing import assert_array_equal
+from gplearn.skutils.testing import assert_raises, assert_warns
 from gplearn.skutils.validation import check_random_state
 
 # load the boston dataset and randomly permute it
@@ -38,6 +50,17 @@ boston.data = boston.data[perm]
 boston.target = boston.target[perm]
 
 
+def _fma(x1, x2, x3):
+    """A user-defined function for the registry tests."""
+    return x1 * x2 + x3
+
+
+def _fma_inplace(x1, x2, x3, out):
+    """An in-place implementation of `_fma`."""
+    product = np.multiply(x1, x2)
+    return np.add(product, x3, out=out)
+
+
 def test_weighted_correlations():
     """Check weighted Pearson correlation coefficient matches scipy"""
 
@@ -66,6 +89,36 @@ def test_weighted_correlations():
     assert_true(abs(scipy_spearman - gplearn_spearman) > 0.01)
 
 
+def test_protected_functions():
+    """Check protected functions match their closures, also when in place"""
+
+    random_state = check_random_state(415)
+    x1 = random_state.uniform(-1, 1, size=500)
+    x2 = random_state.uniform(-1, 1, size=500)
+    x1[::7] = 0.
+    x2[::5] = 0.
+    x2[1] = np.nan
+
+    old_settings = np.seterr(all='ignore')
+    expected = {
+        'div2': np.where(np.abs(x2) > 0.001, np.divide(x1, x2), 1.),
+        'sqrt1': np.sqrt(np.abs(x1)),
+        'log1': np.where(np.abs(x1) > 0.001, np.log(np.abs(x1)), 0.),
+        'inv1': np.where(np.abs(x1) > 0.001, 1. / x1, 0.)}
+    for name, result in expected.items():
+        function = FUNCTIONS[name]
+        args = (x1, x2)[:int(name[-1])]
+        assert_array_almost_equal(function(*args), result)
+        # Write over the last argument
+        args = [arg.copy() for arg in args]
+        function(*args, out=args[-1])
+        assert_array_almost_equal(args[-1], result)
+        # And on scalars
+        args = (np.float64(0.), np.float64(0.))[:int(name[-1])]
+        assert_equal(np.ndim(function(*args)), 0)
+    np.seterr(**old_settings)
+
+
 def test_program_init_method():
     """'full' should create longer and deeper programs than other methods"""
 
@@ -282,6 +335,309 @@ def test_execute():
     assert_array_almost_equal(result, expected)
 
 
+def test_compiled_program():
+    """Check the compiled program is cached and not pickled"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2', 'sqrt1'],
+              'arities': {1: ['sqrt1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=50), (5, 10))
+
+    test_gp = ['mul2', 'div2', 8, 'sqrt1', 1, 'sub2', 9, .5]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    expected = ((X[:, 8] / np.sqrt(np.abs(X[:, 1]))) * (X[:, 9] - .5))
+    assert_array_almost_equal(gp.execute(X), expected)
+    compiled = gp._compiled
+    assert_true(compiled is not None)
+    gp.execute(X)
+    assert_true(gp._compiled is compiled)
+
+    gp2 = pickle.loads(pickle.dumps(gp))
+    assert_true(gp2._compiled is None)
+    assert_array_almost_equal(gp2.execute(X), expected)
+
+    # Degenerative single-node programs
+    gp = _Program(random_state=random_state, program=[3], **params)
+    assert_array_almost_equal(gp.execute(X), X[:, 3])
+    gp = _Program(random_state=random_state, program=[.5], **params)
+    assert_array_almost_equal(gp.execute(X), np.repeat(.5, 5))
+
+
+def test_execute_constants():
+    """Check constant subtrees broadcast and constant programs are arrays"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2', 'log1'],
+              'arities': {1: ['log1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=50), (5, 10))
+
+    # Only constants
+    test_gp = ['add2', 'mul2', .5, .2, 'sub2', .3, 'log1', .0]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    result = gp.execute(X)
+    assert_equal(result.shape, (5,))
+    assert_array_almost_equal(result, np.repeat(.4, 5))
+
+    # Mixed constants and features, including a protected zero division
+    test_gp = ['add2', 'div2', 2, 'sub2', .5, .5, 'mul2', .2, 'sub2', 1, .3]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    assert_array_almost_equal(gp.execute(X), 1. + .2 * (X[:, 1] - .3))
+
+
+def test_execute_registers():
+    """Check work buffers are reused and programs can share a pool"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2'],
+              'arities': {2: ['add2', 'sub2', 'mul2', 'div2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=500), (50, 10))
+
+    # A long chain only ever needs a single buffer
+    test_gp = ['add2'] * 9 + list(range(10))
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    assert_equal(gp._get_compiled()[4], 1)
+    assert_array_almost_equal(gp.execute(X), X.sum(axis=1))
+
+    # A balanced tree needs a buffer per level
+    def balanced(depth, leaves):
+        if depth == 0:
+            return [next(leaves)]
+        return (['mul2'] + balanced(depth - 1, leaves) +
+                balanced(depth - 1, leaves))
+    test_gp = balanced(3, iter(range(8)))
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    assert_equal(gp._get_compiled()[4], 3)
+    assert_array_almost_equal(gp.execute(X), X[:, :8].prod(axis=1))
+
+    # Results from a pool match those from fresh buffers
+    pool = _BufferPool()
+    for i in range(10):
+        gp = _Program(random_state=random_state, **params)
+        assert_array_almost_equal(gp.execute(X, pool), gp.execute(X))
+
+
+def test_common_subexpressions():
+    """Check identical subtrees within a program are evaluated once"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2', 'sqrt1'],
+              'arities': {1: ['sqrt1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=500), (50, 10))
+
+    # A balanced tree of identical subtrees is a chain of squares
+    def balanced(depth):
+        if depth == 0:
+            return [0]
+        return ['mul2'] + balanced(depth - 1) + balanced(depth - 1)
+    gp = _Program(random_state=random_state, program=balanced(6), **params)
+    code, _, _, _, n_registers, _ = gp._get_compiled()
+    assert_equal(len(code), 6)
+    assert_equal(n_registers, 1)
+    assert_array_almost_equal(gp.execute(X), X[:, 0] ** 64)
+
+    # A repeated subtree stays live until its last use
+    test_gp = ['add2', 'div2', 3, 'add2', 1, .5, 'mul2',
+               'sqrt1', 'div2', 3, 'add2', 1, .5, 'div2', 3, 'add2', 1, .5]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    shared = X[:, 3] / (X[:, 1] + .5)
+    assert_equal(len(gp._get_compiled()[0]), 5)
+    assert_array_almost_equal(gp.execute(X), shared +
+                              np.sqrt(np.abs(shared)) * shared)
+    assert_array_almost_equal(gp.execute(X, block_size=7), shared +
+                              np.sqrt(np.abs(shared)) * shared)
+
+    # Repeated subtrees are only kept once in the subtree cache
+    cache = _SubtreeCache(2 ** 20)
+    assert_array_almost_equal(gp.execute(X, cache=cache), gp.execute(X))
+    assert_array_almost_equal(gp.execute(X, cache=cache), gp.execute(X))
+    assert_greater(cache.n_hits, 0)
+
+
+def test_simplify():
+    """Check programs are simplified without changing their results"""
+
+    assert_equal(_simplify(['mul2', 0.5, 'sub2', -0.5, 0.25]), [-0.375])
+    assert_equal(_simplify(['add2', 'neg1', 'neg1', 2, 'abs1', 'abs1', 3]),
+                 ['add2', 2, 'abs1', 3])
+    assert_equal(_simplify(['sqrt1', 'abs1', 'neg1', 'neg1', 1]),
+                 ['sqrt1', 1])
+    assert_equal(_simplify(['sub2', 'mul2', 1, 2, 'mul2', 1, 2]), [0.])
+    assert_equal(_simplify(['div2', 'log1', 0, 'log1', 0]), [1.])
+    assert_equal(_simplify(['max2', 'sin1', 0, 'sin1', 0]), ['sin1', 0])
+    assert_equal(_simplify(['add2', 'sub2', 4, 4, 'mul2', 5, 'div2', 1., 1.]),
+                 [5])
+    # Features are never mistaken for constants of the same value
+    assert_equal(_simplify(['sub2', 1, 1.]), ['sub2', 1, 1.])
+    assert_equal(_simplify(['div2', 2, 0.]), ['div2', 2, 0.])
+
+    # The original program is kept for the genetic operations
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2', 'sqrt1',
+                               'log1', 'abs1', 'neg1', 'max2', 'min2'],
+              'arities': {1: ['sqrt1', 'log1', 'abs1', 'neg1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2', 'max2',
+                              'min2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 3,
+              'const_range': (-1.0, 1.0),
+              'metric': 'rmsle',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(-2, 2, size=300), (100, 3))
+    test_gp = ['neg1', 'neg1', 'sub2', 1, 'neg1', 'neg1', 0.5]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    expected = X[:, 1] - .5
+    expected[expected <= 1e-16] = 0
+    assert_array_almost_equal(gp.execute(X), expected)
+    assert_equal(gp.program, test_gp)
+    # A program simplifying to a feature does not protect X from rmsle
+    gp = _Program(random_state=random_state,
+                  program=['neg1', 'neg1', 0], **params)
+    X_before = X.copy()
+    gp.execute(X)
+    list(_execute_population([gp], X))
+    assert_array_almost_equal(X, X_before)
+
+    def evaluate(program):
+        """Evaluate a program node by node without simplifying it"""
+        node = program.pop(0)
+        if isinstance(node, int):
+            return X[:, node]
+        if isinstance(node, float):
+            return np.repeat(node, X.shape[0])
+        args = [evaluate(program) for _ in range(int(node[-1]))]
+        return FUNCTIONS[node](*args)
+
+    old_settings = np.seterr(all='ignore')
+    for i in range(100):
+        # Sprinkle in some identities
+        gp = _Program(random_state=random_state, **params)
+        program, _, _ = gp.crossover(['neg1', 'neg1'] + gp.program,
+                                     random_state)
+        gp = _Program(random_state=random_state, program=program, **params)
+        program, _, _ = gp.crossover(['sub2', 'abs1', 'neg1', 2,
+                                      'abs1', 'neg1', 2], random_state)
+        gp = _Program(random_state=random_state, program=program, **params)
+        assert_true(len(gp._get_simplified()) <= gp.length_)
+        expected = evaluate(list(gp.program))
+        if gp.length_ > 1:
+            expected = np.where(expected <= 1e-16, 0, expected)
+        assert_array_almost_equal(gp.execute(X), expected)
+    np.seterr(**old_settings)
+
+
+def test_fused_chains():
+    """Check chains of associative functions run as one accumulation"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'max2', 'sqrt1'],
+              'arities': {1: ['sqrt1'],
+                          2: ['add2', 'sub2', 'mul2', 'max2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=500), (50, 10))
+
+    # A long chain is a single instruction, with the same rounding
+    test_gp = ['add2'] * 9 + list(range(10))
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    code, _, _, _, n_registers, _ = gp._get_compiled()
+    assert_equal(len(code), 1)
+    assert_equal(n_registers, 1)
+    expected = X[:, 0].copy()
+    for feature in range(1, 10):
+        expected = expected + X[:, feature]
+    assert_array_equal(gp.execute(X), expected)
+    assert_array_equal(gp.execute(X, block_size=7), expected)
+
+    # Chains continue after their first operand is evaluated
+    test_gp = ['mul2', 2, 'mul2', 'sqrt1', 0, 1]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    assert_equal(len(gp._get_compiled()[0]), 2)
+    assert_array_equal(gp.execute(X), X[:, 2] * (np.sqrt(X[:, 0]) * X[:, 1]))
+
+    # Maximum chains are flattened and their repeated operands dropped
+    test_gp = ['max2', 'max2', 0, 'sqrt1', 1, 'max2', 2, 'max2', 0, 3]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    assert_equal(gp._get_simplified(),
+                 ['max2', 'max2', 'max2', 'sqrt1', 1, 0, 2, 3])
+    assert_equal(len(gp._get_compiled()[0]), 2)
+    assert_array_equal(gp.execute(X), np.max([X[:, 0], np.sqrt(X[:, 1]),
+                                              X[:, 2], X[:, 3]], axis=0))
+
+    # Subtraction is not associative, and results used twice stay put
+    test_gp = ['add2', 'sub2', 'add2', 0, 1, 2, 'add2', 'add2', 0, 1, 3]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    assert_array_equal(gp.execute(X), ((X[:, 0] + X[:, 1]) - X[:, 2]) +
+                       ((X[:, 0] + X[:, 1]) + X[:, 3]))
+    for k, output in _execute_population([gp], X):
+        assert_array_equal(output, gp.execute(X))
+
+
+def test_execute_blocked():
+    """Check executing programs on blocks of rows gives the same results"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2',
+                               'sqrt1', 'log1', 'abs1', 'max2', 'min2'],
+              'arities': {1: ['sqrt1', 'log1', 'abs1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2', 'max2', 'min2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=1000), (100, 10))
+
+    pool = _BufferPool()
+    for i in range(20):
+        gp = _Program(random_state=random_state, **params)
+        expected = gp.execute(X)
+        for block_size in (1, 7, 50, 100, 1000):
+            assert_array_almost_equal(gp.execute(X, block_size=block_size),
+                                      expected)
+            assert_array_almost_equal(gp.execute(X, pool, block_size),
+                                      expected)
+
+
 def test_all_metrics():
     """Check all supported metrics work"""
 
@@ -316,6 +672,72 @@ def test_all_metrics():
     assert_raises(ValueError, gp.raw_fitness, X, y, sample_weight)
 
 
+def test_fitness_context():
+    """Check the fitness context agrees with the metrics it replaces"""
+
+    random_state = check_random_state(0)
+    y = random_state.uniform(size=100)
+    w = random_state.uniform(size=100)
+    expected = {
+        'mean absolute error': lambda y_pred: np.average(np.abs(y_pred - y),
+                                                         weights=w),
+        'mse': lambda y_pred: np.average((y_pred - y) ** 2, weights=w),
+        'rmse': lambda y_pred: np.sqrt(np.average((y_pred - y) ** 2,
+                                                  weights=w)),
+        'rmsle': lambda y_pred: np.sqrt(np.average(
+            (np.log(y_pred + 1) - np.log(y + 1)) ** 2, weights=w)),
+        'pearson': lambda y_pred: weighted_pearson(y_pred, y, w),
+        'spearman': lambda y_pred: weighted_spearman(y_pred, y, w)}
+    for metric, function in expected.items():
+        context = _FitnessContext(y, w, metric)
+        for _ in range(3):
+            y_pred = random_state.uniform(size=100)
+            assert_equal(context(y_pred), function(y_pred))
+        # Programs on integer features and constant programs
+        y_pred = random_state.randint(5, size=100)
+        assert_equal(context(y_pred), function(y_pred))
+        assert_equal(context(np.ones(100)), function(np.ones(100)))
+    assert_raises(ValueError, _FitnessContext, y, w, 'foo')
+
+
+def test_in_bag_fitness():
+    """Check evaluating the in-bag rows matches zero-weighting the others"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2'],
+              'arities': {2: ['add2', 'sub2', 'mul2', 'div2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=500), (50, 10))
+    y = random_state.uniform(size=50)
+    sample_weight = random_state.uniform(size=50)
+    indices = np.sort(random_state.permutation(50)[:30])
+    zeroed_weight = np.zeros(50)
+    zeroed_weight[indices] = sample_weight[indices]
+
+    test_gp = ['mul2', 'div2', 8, 1, 'sub2', 9, .5]
+    gp = _Program(random_state=random_state, program=test_gp, **params)
+    assert_array_almost_equal(gp.execute(X, indices=indices),
+                              gp.execute(X)[indices])
+    assert_array_almost_equal(gp.execute(X, block_size=7, indices=indices),
+                              gp.execute(X)[indices])
+    for m in ['mean absolute error', 'mse', 'rmse', 'rmsle', 'pearson']:
+        gp.metric = m
+        assert_almost_equal(gp.raw_fitness(X, y, sample_weight,
+                                           indices=indices),
+                            gp.raw_fitness(X, y, zeroed_weight))
+
+    # Single-node programs
+    gp = _Program(random_state=random_state, program=[3], **params)
+    assert_array_almost_equal(gp.execute(X, indices=indices),
+                              X[indices, 3])
+
+
 def test_get_subtree():
     """Check that get subtree does the same thing for self and new programs"""
 
@@ -421,6 +843,56 @@ def test_program_input_validation():
         est = Symbolic(init_depth=(2, 2))
         est.fit(boston.data, boston.target)
 
+        # Check invalid subtree_cache_size
+        est = Symbolic(subtree_cache_size=0)
+        assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid parent_cache_size
+        est = Symbolic(parent_cache_size=-1)
+        assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid backend
+        est = Symbolic(backend='foo')
+        assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid islands
+        for params in [{'n_islands': 1},
+                       {'n_islands': 4, 'migration_interval': 0},
+                       {'n_islands': 4, 'migration_topology': 'foo'},
+                       {'n_islands': 4, 'migration_size': 0},
+                       {'n_islands': 4, 'migration_size': 250},
+                       {'n_islands': 4, 'migration_size': 100,
+                        'migration_topology': 'full'}]:
+            est = Symbolic(population_size=1000, **params)
+            assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid size limits
+        est = Symbolic(init_depth=(2, 6), max_depth=5)
+        assert_raises(ValueError, est.fit, boston.data, boston.target)
+        est = Symbolic(max_length=2)
+        assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid function_set
+        for function_set in [[], ['add2', 'foo2']]:
+            est = Symbolic(function_set=function_set)
+            assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid dtype
+        est = Symbolic(dtype=np.int32)
+        assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid approximate and rescore
+        for approximate in ['fast', 2, 'rescore']:
+            est = Symbolic(approximate=approximate)
+            assert_raises(ValueError, est.fit, boston.data, boston.target)
+        est = Symbolic(rescore='yes')
+        assert_raises(ValueError, est.fit, boston.data, boston.target)
+
+        # Check invalid function_costs
+        for function_costs in ['fast', {'foo2': 2.}, {'log1': 0.}]:
+            est = Symbolic(function_costs=function_costs)
+            assert_raises(ValueError, est.fit, boston.data, boston.target)
+
     # Check hall_of_fame and n_components for transformer
     est = SymbolicTransformer(hall_of_fame=1000)
     assert_raises(ValueError, est.fit, boston.data, boston.target)
@@ -513,6 +985,490 @@ def test_subsample():
     assert_true(abs(est1 - est2) > 0.01)
 
 
+def test_fitness_cache():
+    """Check identical offspring reuse the fitness of their relatives"""
+
+    calls = []
+    raw_fitness = _Program.raw_fitness
+
+    def counted_raw_fitness(self, *args, **kwargs):
+        calls.append(self)
+        return raw_fitness(self, *args, **kwargs)
+
+    # Only reproduction after the first generation
+    _Program.raw_fitness = counted_raw_fitness
+    try:
+        est = SymbolicRegressor(population_size=100, generations=3,
+                                p_crossover=0., p_subtree_mutation=0.,
+                                p_hoist_mutation=0., p_point_mutation=0.,
+                                random_state=0)
+        est.fit(boston.data, boston.target)
+    finally:
+        _Program.raw_fitness = raw_fitness
+    assert_true(len(calls) <= 100)
+
+    # The cached fitness is the one the program would have been evaluated to
+    sample_weight = np.ones(boston.target.shape[0])
+    for program in est._programs[-1]:
+        assert_almost_equal(program.raw_fitness_,
+                            program.raw_fitness(boston.data, boston.target,
+                                                sample_weight))
+
+    # Subsampled programs are always evaluated
+    _Program.raw_fitness = counted_raw_fitness
+    calls = []
+    try:
+        est = SymbolicRegressor(population_size=100, generations=3,
+                                p_crossover=0., p_subtree_mutation=0.,
+                                p_hoist_mutation=0., p_point_mutation=0.,
+                                max_samples=0.5, random_state=0)
+        est.fit(boston.data, boston.target)
+    finally:
+        _Program.raw_fitness = raw_fitness
+    assert_equal(len(calls), 300)
+
+
+def test_subtree_cache():
+    """Check cached subtrees give the same results and are reused"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2',
+                               'sqrt1', 'log1', 'abs1', 'max2', 'min2'],
+              'arities': {1: ['sqrt1', 'log1', 'abs1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2', 'max2', 'min2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=1000), (100, 10))
+
+    cache = _SubtreeCache(2 ** 20)
+    for i in range(20):
+        gp = _Program(random_state=random_state, **params)
+        expected = gp.execute(X)
+        assert_array_almost_equal(gp.execute(X, cache=cache), expected)
+        # The second time around, its subtrees come from the cache
+        assert_array_almost_equal(gp.execute(X, block_size=7, cache=cache),
+                                  expected)
+        # Offspring share the outputs of the subtrees of their parents
+        donor = _Program(random_state=random_state, **params)
+        program, _, _ = gp.crossover(donor.program, random_state)
+        child = _Program(random_state=random_state, program=program, **params)
+        assert_array_almost_equal(child.execute(X, cache=cache),
+                                  child.execute(X))
+    assert_greater(cache.n_hits, 0)
+
+    # A tiny cache keeps nothing, but works all the same
+    cache = _SubtreeCache(8)
+    gp = _Program(random_state=random_state, **params)
+    assert_array_almost_equal(gp.execute(X, cache=cache), gp.execute(X))
+    assert_equal(cache.n_bytes, 0)
+
+    # Caching changes nothing about the evolution
+    est1 = SymbolicRegressor(population_size=100, generations=4,
+                             random_state=0)
+    est1.fit(boston.data, boston.target)
+    est2 = SymbolicRegressor(population_size=100, generations=4,
+                             subtree_cache_size=1, random_state=0)
+    est2.fit(boston.data, boston.target)
+    assert_equal(genetic._subtree_cache, (None, None))
+    assert_equal(str(est1._program), str(est2._program))
+    assert_almost_equal(est1._program.raw_fitness_,
+                        est2._program.raw_fitness_)
+
+
+def test_parent_outputs():
+    """Check offspring reuse the kept outputs of their parents' subtrees"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2',
+                               'sqrt1', 'log1', 'abs1', 'max2', 'min2'],
+              'arities': {1: ['sqrt1', 'log1', 'abs1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2', 'max2', 'min2']},
+              'init_depth': (2, 6),
+              'init_method': 'full',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=1000), (100, 10))
+
+    n_inputs = 0
+    for i in range(20):
+        gp = _Program(random_state=random_state, **params)
+        donor = _Program(random_state=random_state, **params)
+        gp.execute(X, keep=True)
+        donor.execute(X, keep=True)
+        program, _, _ = gp.crossover(donor.program, random_state)
+        child = _Program(random_state=random_state, program=program, **params)
+        inputs, _, _ = child._match_subtrees(parents=(gp, donor))
+        n_inputs += len(inputs)
+        expected = child.execute(X)
+        assert_array_almost_equal(child.execute(X, parents=(gp, donor),
+                                                keep=True), expected)
+        # Grandchildren inherit the outputs the child took from its parents
+        program, _ = child.point_mutation(random_state)
+        grandchild = _Program(random_state=random_state, program=program,
+                              **params)
+        assert_array_almost_equal(grandchild.execute(X, parents=(child,),
+                                                     block_size=7),
+                                  grandchild.execute(X))
+        # Nothing is kept on subsamples, nor when pickled
+        gp._outputs = None
+        gp.execute(X, indices=np.arange(50), keep=True)
+        assert_true(gp._outputs is None)
+        assert_true(pickle.loads(pickle.dumps(child))._outputs is None)
+    assert_greater(n_inputs, 0)
+
+    # Keeping outputs changes nothing about the evolution
+    est1 = SymbolicRegressor(population_size=100, generations=4,
+                             random_state=0)
+    est1.fit(boston.data, boston.target)
+    est2 = SymbolicRegressor(population_size=100, generations=4,
+                             parent_cache_size=1, random_state=0)
+    est2.fit(boston.data, boston.target)
+    assert_equal(str(est1._program), str(est2._program))
+    assert_almost_equal(est1._program.raw_fitness_,
+                        est2._program.raw_fitness_)
+    assert_true(all(gp._outputs is None for gp in est2._programs[-1]))
+
+    # Outputs can't be kept for other processes
+    est = SymbolicRegressor(population_size=100, generations=2,
+                            parent_cache_size=1, n_jobs=2, random_state=0)
+    assert_warns(UserWarning, est.fit, boston.data, boston.target)
+
+
+def test_execute_population():
+    """Check a batch of programs evaluates shared subtrees only once"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2',
+                               'sqrt1', 'log1', 'abs1', 'max2', 'min2'],
+              'arities': {1: ['sqrt1', 'log1', 'abs1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2', 'max2', 'min2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'rmsle',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    X = np.reshape(random_state.uniform(size=1000), (100, 10))
+
+    parents = [_Program(random_state=random_state, **params)
+               for _ in range(10)]
+    programs = list(parents)
+    for i in range(40):
+        parent = parents[random_state.randint(10)]
+        donor = parents[random_state.randint(10)]
+        program, _, _ = parent.crossover(donor.program, random_state)
+        programs.append(_Program(random_state=random_state, program=program,
+                                 **params))
+    # Duplicates, single nodes and constants
+    for program in [parents[0].program, [3], [0.5], ['add2', 0.5, -0.2],
+                    ['add2', 3, 3]]:
+        programs.append(_Program(random_state=random_state, program=program,
+                                 **params))
+
+    code = _compile_population(programs)[0]
+    n_functions = sum(1 for function, _, _, _ in code if function is not None)
+    assert_true(n_functions < sum(gp.length_ for gp in programs))
+
+    seen = set()
+    for pool in [None, _BufferPool()]:
+        for k, output in _execute_population(programs, X, pool):
+            seen.add(k)
+            assert_array_almost_equal(output, programs[k].execute(X))
+    assert_equal(seen, set(range(len(programs))))
+
+    # On blocks of rows, and with batches split to fit in fewer registers
+    max_registers = genetic._MAX_REGISTERS
+    try:
+        for genetic._MAX_REGISTERS in [max_registers, 2]:
+            for pool in [None, _BufferPool()]:
+                seen = set()
+                for k, output in _execute_population(programs, X, pool,
+                                                     block_size=7):
+                    seen.add(k)
+                    assert_array_almost_equal(output, programs[k].execute(X))
+                assert_equal(seen, set(range(len(programs))))
+    finally:
+        genetic._MAX_REGISTERS = max_registers
+
+
+def test_size_limits():
+    """Check max_depth and max_length bound every generation"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2', 'sqrt1'],
+              'arities': {1: ['sqrt1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2']},
+              'init_depth': (6, 6),
+              'init_method': 'full',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+
+    # Naive programs are grown within max_length
+    for max_length in [3, 10, 25]:
+        for i in range(20):
+            gp = _Program(random_state=random_state, max_length=max_length,
+                          **params)
+            assert_true(gp.length_ <= max_length)
+            assert_true(gp.validate_program())
+
+    # Without parsimony, programs bloat unless limited
+    est = SymbolicRegressor(population_size=100, generations=5,
+                            parsimony_coefficient=0., max_depth=6,
+                            max_length=31, random_state=0)
+    est.fit(boston.data, boston.target)
+    for generation in est._programs:
+        for gp in generation:
+            assert_true(gp.depth_ <= 6)
+            assert_true(gp.length_ <= 31)
+    est = SymbolicTransformer(population_size=100, generations=3,
+                              parsimony_coefficient=0., max_length=15,
+                              random_state=0)
+    est.fit(boston.data, boston.target)
+    assert_true(all(gp.length_ <= 15 for generation in est._programs
+                    for gp in generation))
+
+    # Limits that are never reached change nothing
+    est1 = SymbolicRegressor(population_size=100, generations=3,
+                             random_state=0)
+    est1.fit(boston.data, boston.target)
+    est2 = SymbolicRegressor(population_size=100, generations=3,
+                             max_depth=1000, max_length=10 ** 6,
+                             random_state=0)
+    est2.fit(boston.data, boston.target)
+    assert_equal(str(est1._program), str(est2._program))
+
+
+def test_function_costs():
+    """Check that function costs weight the parsimony penalty"""
+
+    params = {'function_set': ['add2', 'sub2', 'mul2', 'div2', 'log1'],
+              'arities': {1: ['log1'],
+                          2: ['add2', 'sub2', 'mul2', 'div2']},
+              'init_depth': (2, 6),
+              'init_method': 'half and half',
+              'n_features': 10,
+              'const_range': (-1.0, 1.0),
+              'metric': 'mean absolute error',
+              'p_point_replace': 0.05,
+              'parsimony_coefficient': 0.1}
+    random_state = check_random_state(415)
+    program = ['add2', 'log1', 0, 'div2', 1, 2.5]
+    gp = _Program(random_state=random_state, program=program, **params)
+    gp.raw_fitness_ = 1.
+    assert_almost_equal(gp.cost_, 6.)
+    assert_almost_equal(gp.fitness(), 1.6)
+    gp = _Program(random_state=random_state, program=program,
+                  function_costs={'log1': 5., 'div2': 3.}, **params)
+    gp.raw_fitness_ = 1.
+    assert_almost_equal(gp.cost_, 12.)
+    assert_almost_equal(gp.fitness(), 2.2)
+    # Costs above the length are penalized even when the length is rewarded
+    assert_almost_equal(gp.fitness(-0.1), 1.)
+
+    # Measured costs are relative to addition
+    est = SymbolicRegressor(population_size=50, generations=2,
+                            function_costs='auto', random_state=0)
+    est.fit(boston.data, boston.target)
+    assert_true(all(gp.function_costs['add2'] == 1. for gp in
+                    est._programs[-1]))
+    assert_true(all(cost > 0 for cost in
+                    est._program.function_costs.values()))
+
+    # Expensive functions are selected against
+    n_logs = []
+    for function_costs in [None, {'log1': 100., 'sqrt1': 100.}]:
+        est = SymbolicRegressor(population_size=200, generations=5,
+                                parsimony_coefficient='auto',
+                                function_costs=function_costs,
+                                random_state=0)
+        est.fit(boston.data, boston.target)
+        n_logs.append(sum(node in ('log1', 'sqrt1')
+                          for gp in est._programs[-1] for node in gp.program))
+    assert_greater(n_logs[0], n_logs[1])
+
+    # Unit costs change nothing
+    est1 = SymbolicRegressor(population_size=100, generations=3,
+                             random_state=0)
+    est1.fit(boston.data, boston.target)
+    est2 = SymbolicRegressor(population_size=100, generations=3,
+                             function_costs={}, random_state=0)
+    est2.fit(boston.data, boston.target)
+    assert_equal(str(est1._program), str(est2._program))
+
+
+def test_register_function():
+    """Check that registered functions are used by the estimators"""
+
+    # Invalid registrations
+    assert_raises(ValueError, register_function, np.add, 'add2', 2)
+    assert_raises(ValueError, register_function, _fma, 'fma', 0)
+    assert_raises(ValueError, register_function, _fma, 'fma', 3, cost=-1.)
+    assert_raises(ValueError, register_function, lambda x1: x1, 'id', 1)
+    assert_raises(ValueError, register_function, np.sum, 'sum', 1)
+    assert_true('id' not in FUNCTIONS and 'sum' not in FUNCTIONS)
+
+    try:
+        # Unprotected functions are closed by the registry
+        register_function(np.log, 'ulog', 1, closure=False, cost=10.)
+        x1 = np.array([-1., 0., np.e])
+        assert_array_almost_equal(FUNCTIONS['ulog'](x1), [0., 0., 1.])
+        out = np.empty(3)
+        FUNCTIONS['ulog'](x1, out=out)
+        assert_array_almost_equal(out, [0., 0., 1.])
+
+        # Functions with and without an in-place implementation agree
+        x = [np.arange(5.), np.arange(5.), np.ones(5)]
+        for inplace in [None, _fma_inplace]:
+            register_function(_fma, 'fma', 3, inplace=inplace)
+            out = x[0].copy()
+            FUNCTIONS['fma'](x[0], x[1], x[2], out=out)
+            assert_array_almost_equal(out, x[0] ** 2 + 1)
+
+        # Registered functions are available in parallel fits and once pickled
+        function_set = ['add2', 'sub2', 'mul2', 'fma', 'ulog']
+        for n_jobs in [1, 2]:
+            est = SymbolicRegressor(population_size=100, generations=3,
+                                    function_set=function_set,
+                                    function_costs={}, n_jobs=n_jobs,
+                                    random_state=0)
+            est.fit(boston.data, boston.target)
+            nodes = set(node for gp in est._programs[-1]
+                        for node in gp.program)
+            assert_true('fma' in nodes)
+            assert_true(all(gp.function_costs['ulog'] == 10. for gp in
+                            est._programs[-1]))
+            est2 = pickle.loads(pickle.dumps(est))
+            assert_array_almost_equal(est.predict(boston.data),
+                                      est2.predict(boston.data))
+
+        # A fitted estimator does not replace another function of the same name
+        register_function(_fma, 'fma', 3, closure=False)
+        assert_raises(ValueError, est.predict, boston.data)
+        register_function(_fma, 'fma', 3, inplace=_fma_inplace)
+        est.predict(boston.data)
+
+        random_state = check_random_state(415)
+        gp = _Program(function_set=function_set,
+                      arities={1: ['ulog'], 2: ['add2', 'sub2', 'mul2'],
+                               3: ['fma']},
+                      init_depth=(2, 6), init_method='half and half',
+                      n_features=10, const_range=(-1.0, 1.0), metric='mse',
+                      p_point_replace=0.05, parsimony_coefficient=0.1,
+                      random_state=random_state,
+                      program=['fma', 'ulog', 0, 1, 'add2', 2, 0.5])
+        assert_equal(str(gp), 'fma(ulog(X0), X1, add(X2, 0.500))')
+        assert_equal(gp.depth_, 2)
+        assert_array_almost_equal(gp.execute(boston.data),
+                                  _fma(np.log(boston.data[:, 0]),
+                                       boston.data[:, 1],
+                                       boston.data[:, 2] + 0.5))
+    finally:
+        # Leave the registry as the other tests expect it
+        for name in ('ulog', 'fma'):
+            FUNCTIONS.pop(name, None)
+            genetic._ARITIES.pop(name, None)
+            genetic._function_timings.pop(name, None)
+
+
+def test_approximations():
+    """Check the approximate transcendental functions"""
+
+    random_state = check_random_state(0)
+    x1 = np.concatenate([random_state.uniform(-1000., 1000., 5000),
+                         random_state.uniform(-2., 2., 5000),
+                         [0., 1e-4, -1e-4, 1., np.pi]])
+    for function, approximation in _APPROXIMATIONS.items():
+        exact = function(x1)
+        assert_array_almost_equal(approximation(x1) / np.maximum(
+            np.abs(exact), 1.), exact / np.maximum(np.abs(exact), 1.), 6)
+        # In place, as written into the work buffers
+        out = x1.copy()
+        approximation(out, out=out)
+        assert_array_equal(out, approximation(x1))
+    assert_array_equal(_APPROXIMATIONS[protected_log](np.array([0., 1e-4])),
+                       [0., 0.])
+    assert_true(set(_get_approximations().items()) <=
+                set(_APPROXIMATIONS.items()))
+
+    # The tangent stays finite at its poles
+    poles = np.array([np.pi / 2, -np.pi / 2])
+    assert_array_almost_equal(_APPROXIMATIONS[np.tan](poles) / np.tan(poles),
+                              [1., 1.])
+    assert_true(np.isfinite(_APPROXIMATIONS[np.tan](3 * poles)).all())
+
+    # Every job uses the approximations chosen for the fit
+    programs = []
+    for n_jobs in [1, 2]:
+        est = SymbolicRegressor(population_size=100, generations=2,
+                                trigonometric=True, approximate=True,
+                                n_jobs=n_jobs, random_state=0)
+        est.fit(boston.data[:100, :], boston.target[:100])
+        programs.append([gp.program for gp in est._programs[-1]])
+    assert_equal(programs[0], programs[1])
+
+    # The final generation can be chosen by its exact fitness
+    est = SymbolicRegressor(population_size=100, generations=3,
+                            trigonometric=True, max_samples=0.9,
+                            approximate=True, rescore=True, random_state=0)
+    est.fit(boston.data, boston.target)
+    for gp in est._programs[-1]:
+        assert_equal(gp.raw_fitness_,
+                     gp.raw_fitness(boston.data, boston.target,
+                                    np.ones(boston.target.shape),
+                                    indices=gp.indices_))
+    assert_array_equal(est.predict(boston.data),
+                       est._program.execute(boston.data))
+
+
+def test_float32():
+    """Check that programs can be evolved in single precision"""
+
+    X = boston.data.astype(np.float32)
+    for Symbolic in (SymbolicRegressor, SymbolicTransformer):
+        est32 = Symbolic(population_size=100, generations=3,
+                         dtype=np.float32, random_state=0)
+        est32.fit(boston.data, boston.target)
+        for gp in est32._programs[-1]:
+            assert_equal(gp.execute(X).dtype, np.float32)
+        if Symbolic is SymbolicRegressor:
+            y_pred = est32.predict(boston.data)
+            program = est32._program
+        else:
+            y_pred = est32.transform(boston.data)[:, 0]
+            program = est32._best_programs[0]
+        assert_equal(y_pred.dtype, np.float32)
+        assert_array_almost_equal(y_pred / np.abs(y_pred).max(),
+                                  program.execute(boston.data) /
+                                  np.abs(y_pred).max(), 3)
+
+    # The final generation can be scored in double precision
+    est = SymbolicRegressor(population_size=100, generations=3,
+                            dtype=np.float32, rescore=True, random_state=0)
+    est.fit(boston.data, boston.target)
+    for gp in est._programs[-1]:
+        assert_equal(gp.raw_fitness_,
+                     gp.raw_fitness(boston.data, boston.target,
+                                    np.ones(boston.target.shape)))
+
+    # Work buffers are kept per type
+    pool = _BufferPool()
+    assert_equal(pool.get(2, 10)[0].dtype, np.float64)
+    assert_equal(pool.get(2, 10, np.float32)[0].dtype, np.float32)
+    assert_equal(pool.get(2, 10)[1].dtype, np.float64)
+
+
 def test_parsimony_coefficient():
     """Check that parsimony coefficients work and that results differ"""
 
@@ -627,6 +1583,118 @@ def test_more_verbose_output():
     assert_equal(20, n_lines)
 
 
+def test_population_encoding():
+    """Check programs survive the compact encoding used with workers"""
+
+    est = SymbolicRegressor(population_size=50, generations=2,
+                            max_samples=0.7, random_state=0)
+    est.fit(boston.data, boston.target)
+    programs = est._programs[-1]
+    n_samples = boston.data.shape[0]
+    population = _Population(programs, est._function_set,
+                             [gp.raw_fitness_ for gp in programs],
+                             [gp.parents for gp in programs],
+                             [gp.indices_ for gp in programs], n_samples)
+    population = pickle.loads(pickle.dumps(population))
+    assert_equal(len(population), len(programs))
+    for i, gp in enumerate(programs):
+        program = population.get_program(i)
+        assert_equal(program, gp.program)
+        assert_equal([type(node) for node in program],
+                     [type(node) for node in gp.program])
+        assert_equal(population.fitness[i], gp.raw_fitness_)
+        assert_equal(population.genomes[i], gp.parents)
+        assert_array_equal(population.get_indices(i, n_samples), gp.indices_)
+
+    # Without subsamples, every program is evaluated on all of the rows
+    population = _Population(programs, est._function_set,
+                             [gp.fitness_ for gp in programs])
+    assert_array_equal(population.get_indices(0, n_samples),
+                       np.arange(n_samples))
+    # They share one read-only array
+    indices = population.get_indices(0, n_samples)
+    assert_true(population.get_indices(1, n_samples) is indices)
+    assert_false(indices.flags.writeable)
+
+
+def test_balance_costs():
+    """Check programs are shared out between jobs by their cost"""
+
+    # One costly program, and many cheap ones
+    costs = [1, 1, 100, 1, 1, 1, 1, 1, 1, 1, 1, 1, 98]
+    jobs = _balance_costs(costs, 2)
+    assert_equal(sorted(sum(jobs, [])), list(range(len(costs))))
+    loads = [sum(costs[k] for k in job) for job in jobs]
+    assert_equal(sorted(loads), [104, 105])
+    for job in jobs:
+        assert_equal(job, sorted(job))
+    assert_equal(jobs, _balance_costs(costs, 2))
+
+    # More jobs than programs
+    jobs = _balance_costs([3, 2], 4)
+    assert_equal(jobs, [[0], [1], [], []])
+
+    # Evaluating the programs out of order does not change the results
+    est1 = SymbolicRegressor(population_size=100, generations=3,
+                             random_state=0)
+    est1.fit(boston.data[:100, :], boston.target[:100])
+    est2 = SymbolicRegressor(population_size=100, generations=3,
+                             random_state=0, n_jobs=3)
+    est2.fit(boston.data[:100, :], boston.target[:100])
+    for gp1, gp2 in zip(est1._programs[-1], est2._programs[-1]):
+        assert_equal(gp1.program, gp2.program)
+        assert_equal(gp1.parents, gp2.parents)
+        assert_almost_equal(gp1.raw_fitness_, gp2.raw_fitness_)
+
+
+def test_shared_arrays():
+    """Check data is shared through read-only memory maps, then deleted"""
+
+    X = np.asfortranarray(boston.data)
+    arrays = [X, boston.target, None]
+    with _SharedArrays(arrays) as data:
+        X_shared, y_shared, w_shared = data.arrays
+        assert_true(isinstance(X_shared, np.memmap))
+        assert_false(X_shared.flags.writeable)
+        assert_true(X_shared.flags.f_contiguous)
+        assert_array_equal(X_shared, X)
+        assert_array_equal(y_shared, boston.target)
+        assert_true(w_shared is None)
+        temp_folder = os.path.dirname(X_shared.filename)
+        assert_true(os.path.isdir(temp_folder))
+        del X_shared, y_shared
+    assert_false(os.path.exists(temp_folder))
+    assert_true(data.arrays is arrays)
+
+    # Files are deleted when the fit raises
+    data = _SharedArrays(arrays)
+    try:
+        with data:
+            temp_folder = os.path.dirname(data.arrays[0].filename)
+            raise ValueError
+    except ValueError:
+        pass
+    assert_false(os.path.exists(temp_folder))
+
+    # Nothing is written without sharing
+    with _SharedArrays(arrays, share=False) as data:
+        assert_true(data.arrays is arrays)
+
+    # A folder that can't be deleted is reported
+    def rmtree(path):
+        raise OSError('The files are in use')
+    data = _SharedArrays(arrays).__enter__()
+    temp_folder = os.path.dirname(data.arrays[0].filename)
+    shutil_rmtree = shutil.rmtree
+    shutil.rmtree = rmtree
+    try:
+        assert_warns(UserWarning, data.__exit__)
+    finally:
+        shutil.rmtree = shutil_rmtree
+    assert_true(os.path.isdir(temp_folder))
+    shutil.rmtree(temp_folder)
+
+
 def test_parallel_train():
     """Check predictions are the same for different n_jobs"""
 
@@ -662,6 +1730,89 @@ def test_parallel_train():
         assert_array_almost_equal(len1, len2)
 
 
+def test_threading_backend():
+    """Check threads give the same programs, and leave the error state"""
+
+    old_settings = np.geterr()
+    for params in [{'max_samples': 1.0},
+                   {'max_samples': 1.0, 'subtree_cache_size': 1},
+                   {'max_samples': 0.7}]:
+        ests = [
+            SymbolicRegressor(population_size=100, generations=3,
+                              n_jobs=n_jobs, backend=backend, random_state=0,
+                              **params).fit(boston.data[:100, :],
+                                            boston.target[:100])
+            for n_jobs, backend in [(1, 'multiprocessing'),
+                                    (3, 'multiprocessing'),
+                                    (3, 'threading')]
+        ]
+        for est in ests[1:]:
+            for gp1, gp2 in zip(ests[0]._programs[-1], est._programs[-1]):
+                assert_equal(gp1.program, gp2.program)
+                assert_almost_equal(gp1.raw_fitness_, gp2.raw_fitness_)
+        assert_equal(np.geterr(), old_settings)
+
+    # The subtree cache may be shared by threads
+    cache = _SubtreeCache(2 ** 20)
+    cache.put('a', np.ones(10))
+    assert_true(cache.get('a') is not None)
+    assert_equal((cache.n_hits, cache.n_lookups), (1, 1))
+    counts = []
+    thread = threading.Thread(
+        target=lambda: counts.append((cache.get('a') is not None,
+                                      cache.n_hits, cache.n_lookups)))
+    thread.start()
+    thread.join()
+    assert_equal(counts, [(True, 1, 1)])
+    assert_equal((cache.n_hits, cache.n_lookups), (1, 1))
+
+
+def test_islands():
+    """Check islands evolve the same for different n_jobs, and migrate"""
+
+    for topology in ['ring', 'random', 'full']:
+        ests = [
+            SymbolicRegressor(population_size=100, generations=5,
+                              n_islands=4, migration_interval=2,
+                              migration_size=2, migration_topology=topology,
+                              n_jobs=n_jobs, backend=backend,
+                              random_state=0).fit(boston.data[:100, :],
+                                                  boston.target[:100])
+            for n_jobs, backend in [(1, 'multiprocessing'),
+                                    (3, 'multiprocessing'),
+                                    (3, 'threading')]
+        ]
+        for est in ests[1:]:
+            for gp1, gp2 in zip(ests[0]._programs[-1], est._programs[-1]):
+                assert_equal(gp1.program, gp2.program)
+                assert_almost_equal(gp1.raw_fitness_, gp2.raw_fitness_)
+
+        # Genomes refer to the programs of the whole previous generation
+        programs = ests[0]._programs
+        assert_equal(len(programs), 5)
+        migrated = False
+        for gen in range(1, 5):
+            for i, gp in enumerate(programs[gen]):
+                assert_equal(len(programs[gen]), 100)
+                parent = gp.parents['parent_idx']
+                if gp.parents['method'] == 'Reproduction':
+                    assert_equal(gp.program, programs[gen - 1][parent].program)
+                # Islands hold 25 programs each
+                if parent // 25 != i // 25:
+                    migrated = True
+                    # Only at the start of an epoch
+                    assert_equal(gen % 2, 0)
+        assert_true(migrated)
+
+    # Subsamples, and parsimony within each island
+    est = SymbolicRegressor(population_size=100, generations=3, n_islands=2,
+                            migration_interval=1, max_samples=0.7,
+                            parsimony_coefficient='auto', random_state=0)
+    est.fit(boston.data[:100, :], boston.target[:100])
+    for gp in est._programs[-1]:
+        assert_equal(gp.indices_.shape[0], 70)
+
+
 def test_pickle():
     """Check pickability"""
 
@@ -720,6 +1871,15 @@ def test_memory_layout():
             y = boston.target[::3]
             est.fit(X, y)
 
+            # Predictions don't depend on the memory layout
+            if Symbolic is SymbolicRegressor:
+                predict = est.predict
+            else:
+                predict = est.transform
+            X_c = np.asarray(boston.data, order="C", dtype=dtype)
+            X_f = np.asarray(boston.data, order="F", dtype=dtype)
+            assert_array_almost_equal(predict(X_c), predict(X_f))
+
 
 def test_input_shape():
     """Check changed dimensions cause failure"""